@@ -0,0 +1,71 @@
+import os
+import zipfile
+from collections import OrderedDict
+from types import MappingProxyType
+
+# entries metadata, as written by ricecooker's html_writer.HTMLWriter
+DATE_TIME = (2013, 3, 14, 1, 59, 26)
+COMMENT = "HTML FILE".encode()
+
+
+class ZipAssembly:
+    """HTML5 zip collected in memory then written in a single pass
+
+    Same API and same entries as html_writer.HTMLWriter (first entry for a
+    path wins) without reopening and rewriting the archive for each file."""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+
+    def contains(self, filename):
+        return filename in self.entries
+
+    def write_contents(self, filename, contents, directory=None):
+        filepath = (
+            "{}/{}".format(directory.rstrip("/"), filename) if directory else filename
+        )
+        if not self.contains(filepath):
+            self.entries[filepath] = contents
+        return filepath
+
+    def write_index_contents(self, contents):
+        return self.write_contents("index.html", contents)
+
+    def write(self, filepath):
+        """writes the zip to filepath, replacing it at once when complete"""
+        if not self.contains("index.html"):
+            raise ReferenceError(
+                "Invalid Zip at {}: missing index.html file".format(filepath)
+            )
+        tmp_filepath = "{}.{}.tmp".format(filepath, os.getpid())
+        with zipfile.ZipFile(tmp_filepath, "w") as zf:
+            for filename, contents in self.entries.items():
+                info = zipfile.ZipInfo(filename, date_time=DATE_TIME)
+                info.comment = COMMENT
+                info.compress_type = zipfile.ZIP_STORED
+                info.create_system = 0
+                zf.writestr(info, contents)
+        os.replace(tmp_filepath, filepath)
+
+
+class AssetBundle:
+    """Static entries shared by many zips, read once and copied as-is
+
+    maps zip path: bytes ; entries are stored uncompressed so copying them
+    costs no more than a CRC"""
+
+    def __init__(self, entries):
+        self.entries = MappingProxyType(OrderedDict(entries))
+
+    @classmethod
+    def from_files(cls, files):
+        """ bundle of [(zip path, local filepath), ...] text files """
+        entries = []
+        for arcname, filepath in files:
+            with open(filepath) as f:
+                entries.append((arcname, f.read().encode("utf-8")))
+        return cls(entries)
+
+    def write_into(self, zipper):
+        for arcname, contents in self.entries.items():
+            zipper.write_contents(arcname, contents)
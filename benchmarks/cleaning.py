@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Time of the single-walk chapter cleaning against the former helper chain
+
+    python benchmarks/cleaning.py [PAGES_DIR] [--rounds 3] [--chapters 20]
+
+Chapters are read from the stored .html pages of PAGES_DIR (see
+benchmarks/parsers.py --download), or generated when no directory is given.
+Both ways clean each chapter body, rewrite its image sources and extract its
+video, PDF and PhET URLs ; any chapter for which they differ is reported."""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parsers  # noqa: E402
+from utils import (  # noqa: E402
+    ContentWalk,
+    link_to_text,
+    remove_iframes,
+    remove_links,
+    remove_scripts,
+    remove_src_set,
+)
+
+PARAGRAPH = (
+    '<p>Paragraph {i} with <a href="/Bookshelves/Unit_{i}">a page</a>, '
+    '<a href="https://example.org/{i}">a site</a>, <a href="#{i}">a note</a>, '
+    '<a href="/@api/deki/files/{i}/notes.pdf">a PDF</a> and <b>bold <i>text</i></b>.'
+    '<img src="/@api/deki/files/{i}/figure.png" srcset="/@api/deki/files/{i}/a.png 2x">'
+    "</p>"
+)
+MEDIA = [
+    '<iframe src="https://www.youtube.com/embed/v{i}?rel=0"></iframe>',
+    '<iframe src="https://phet.colorado.edu/sims/html/sim{i}/latest/sim{i}_en.html">'
+    "</iframe>",
+    '<p><a href="https://youtu.be/v{i}">watch</a> on <span>YouTube</span></p>',
+    '<script type="text/javascript">window.figure{i} = true;</script>',
+]
+
+
+def generated_chapters(count, paragraphs=2000):
+    rng = random.Random(0)
+    chapters = {}
+    for n in range(count):
+        parts = []
+        for i in range(paragraphs):
+            parts.append(PARAGRAPH.format(i=rng.randint(0, paragraphs)))
+            if i % 50 == 0:
+                parts.append(rng.choice(MEDIA).format(i=i))
+        chapters[f"generated_{n}"] = (
+            '<html><body><section class="mt-content-container">{}</section>'
+            "</body></html>".format("".join(parts))
+        ).encode("utf-8")
+    return chapters
+
+
+def read_chapters(pages_dir):
+    chapters = {}
+    for name in sorted(os.listdir(pages_dir)):
+        if name.endswith(".html"):
+            with open(os.path.join(pages_dir, name), "rb") as fh:
+                chapters[name] = fh.read()
+    return chapters
+
+
+def body(page):
+    return parsers.parse(page, parsers.parser_for("chapter")).find(
+        "section", class_="mt-content-container"
+    )
+
+
+def chain(content):
+    """ former Chapter code: one find_all per extractor and cleaning helper """
+    videos = set(
+        tag.get("href", "")
+        for tag in content.find_all(
+            lambda tag: tag.name == "a"
+            and tag.attrs.get("href", "").find("youtube") != -1
+            or tag.attrs.get("href", "").find("youtu.be") != -1
+            or tag.text.lower() == "youtube"
+        )
+    )
+    videos.update(iframe["src"] for iframe in content.find_all("iframe"))
+    pdfs = set(
+        tag.get("href", "")
+        for tag in content.find_all(
+            lambda tag: tag.name == "a" and tag.attrs.get("href", "").endswith(".pdf")
+        )
+    )
+    phets = set(
+        tag.get("src", "")
+        for tag in content.find_all(
+            lambda tag: tag.name == "iframe"
+            and tag.attrs.get("src", "").find("phet.colorado.edu") != -1
+        )
+    )
+    link_to_text(content)
+    remove_links(content)
+    remove_iframes(content)
+    remove_scripts(content)
+    remove_src_set(content)
+    images = [img.get("src") for img in content.find_all("img")]
+    return videos, pdfs, phets, images
+
+
+def walk(content):
+    """ Chapter code: a single ContentWalk """
+    content_walk = ContentWalk(content)
+    videos = set(content_walk.video_hrefs)
+    videos.update(iframe["src"] for iframe in content_walk.iframes)
+    pdfs = set(content_walk.pdf_hrefs)
+    phets = set(content_walk.phet_srcs)
+    content_walk.clean()
+    images = [img.get("src") for img in content_walk.images()]
+    return videos, pdfs, phets, images
+
+
+def timed(fn, chapters, rounds):
+    """seconds per round of fn over fresh bodies (parsing and serializing
+    excluded), its results and cleaned HTML of the last round"""
+    elapsed = 0
+    for _ in range(rounds):
+        bodies = {name: body(page) for name, page in chapters.items()}
+        start = time.perf_counter()
+        results = {name: fn(content) for name, content in bodies.items() if content}
+        elapsed += time.perf_counter() - start
+    for name, result in results.items():
+        results[name] = result + (str(bodies[name]),)
+    return elapsed / rounds, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("pages_dir", nargs="?", help="directory of stored .html pages")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--chapters", type=int, default=20, help="chapters generated without pages"
+    )
+    args = parser.parse_args()
+
+    if args.pages_dir:
+        chapters = read_chapters(args.pages_dir)
+    else:
+        chapters = generated_chapters(args.chapters)
+    if not chapters:
+        parser.error(f"no .html page in {args.pages_dir}")
+    size = sum(len(page) for page in chapters.values())
+    print(f"{len(chapters)} chapters, {size / 2**20:.1f} MiB, {args.rounds} rounds\n")
+
+    chain_time, expected = timed(chain, chapters, args.rounds)
+    walk_time, results = timed(walk, chapters, args.rounds)
+    mismatches = [name for name in expected if results.get(name) != expected[name]]
+
+    print(f"{'cleaning':<12} {'time (s)':>9} {'ms/chapter':>11} {'speedup':>8}")
+    for label, elapsed in [("chain", chain_time), ("single walk", walk_time)]:
+        print(
+            f"{label:<12} {elapsed:>9.3f} {elapsed * 1000 / len(expected):>11.1f} "
+            f"{chain_time / elapsed:>7.1f}x"
+        )
+    print(f"\n{len(mismatches)} mismatches")
+    for name in mismatches:
+        print(f"    {name}")
+
+
+if __name__ == "__main__":
+    main()
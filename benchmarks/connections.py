@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Connection setup cost of bare requests.get calls vs. the pooled session
+
+    python benchmarks/connections.py [--requests 400] [--threads 8]
+        [--setup-ms 30] [--size 20000]
+
+Both clients fetch the same URLs from a local stand-in server with the same
+number of threads. The server delays each new connection by --setup-ms to
+stand for the TCP+TLS handshakes of a remote host, and counts connections."""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from httpclient import PooledSession  # noqa: E402
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, setup_delay, size):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.setup_delay = setup_delay
+        self.body = b"x" * size
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}".format(self.server_port)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # no delayed ACK stall between responses
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.setup_delay)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(server, get, urls, threads):
+    server.connections = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for response in executor.map(get, urls):
+            assert response.status_code == 200
+    return time.perf_counter() - start, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--setup-ms", type=float, default=30)
+    parser.add_argument("--size", type=int, default=20000, help="body bytes")
+    args = parser.parse_args()
+
+    server = StandInServer(args.setup_ms / 1000, args.size)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = ["{}/page/{}".format(server.base_url, i) for i in range(args.requests)]
+
+    session = PooledSession(per_host=args.threads, rate=None)
+    clients = [
+        ("requests.get", lambda url: requests.get(url, timeout=60)),
+        ("PooledSession", session.get),
+    ]
+    results = {}
+    for name, get in clients:
+        elapsed, connections = run(server, get, urls, args.threads)
+        results[name] = elapsed
+        print(
+            "{:<14} {:7.2f}s  {:7.1f} req/s  {:5} connections".format(
+                name, elapsed, args.requests / elapsed, connections
+            )
+        )
+    print("speedup: {:.1f}x".format(results["requests.get"] / results["PooledSession"]))
+    session.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""Parse time of each HTML parser backend over stored LibreTexts pages
+
+    python benchmarks/parsers.py PAGES_DIR [--rounds 3]
+    python benchmarks/parsers.py PAGES_DIR --download URL [URL ...]
+
+Each backend's extracted links and cleaned chapter HTML are compared with
+those of the call site's current parser (see parsers.PARSERS). A backend is
+safe for a call site if it reports no mismatch for what that site extracts."""
+
+import argparse
+import os
+import sys
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+import parsers  # noqa: E402
+from sushichef import Browser, thumbnails_links  # noqa: E402
+from utils import ContentWalk  # noqa: E402
+
+# what the crawl reads from a page: call site reading it
+EXTRACTS = {
+    "content links": "browser",
+    "index links": "index",
+    "cleaned chapter": "chapter",
+}
+
+
+def save_pages(pages_dir, urls):
+    os.makedirs(pages_dir, exist_ok=True)
+    for url in urls:
+        response = requests.get(url, timeout=60)
+        name = urlparse(url).path.strip("/").replace("/", "_") or "index"
+        with open(os.path.join(pages_dir, f"{name}.html"), "wb") as fh:
+            fh.write(response.content)
+        print(f"saved {url}")
+
+
+def read_pages(pages_dir):
+    pages = {}
+    for name in sorted(os.listdir(pages_dir)):
+        if name.endswith(".html"):
+            with open(os.path.join(pages_dir, name), "rb") as fh:
+                pages[name] = fh.read()
+    return pages
+
+
+def content_links(tree):
+    return [(a.text, a.attrs.get("href")) for a in Browser.links(tree)]
+
+
+def index_links(soup):
+    links = []
+    for parent, class_ in [
+        ("dt", "mt-listing-detailed-title"),
+        ("li", "mt-sortable-listing"),
+        ("div", "wiki-tree"),
+    ]:
+        links.append(
+            [
+                a.attrs.get("href")
+                for a in soup.find_all(
+                    lambda tag: tag.name == "a"
+                    and tag.findParent(parent, class_=class_)
+                )
+            ]
+        )
+    links.append(sorted(thumbnails_links(soup, "li", "mt-sortable-listing").items()))
+    return links
+
+
+def cleaned_chapter(soup):
+    section = soup.find("section", class_="mt-content-container")
+    if section is None:
+        return None
+    return str(ContentWalk(section).clean())
+
+
+def extract(tree, backend):
+    """ what the crawl reads from a page, for comparison between backends """
+    if backend == "selectolax":
+        return {"content links": content_links(tree)}
+    return {
+        "content links": content_links(tree),
+        "index links": index_links(tree),
+        "cleaned chapter": cleaned_chapter(tree),
+    }
+
+
+def available_backends():
+    backends = []
+    for backend in parsers.BACKENDS:
+        try:
+            parsers.parse(b"<p></p>", backend)
+        except Exception:
+            print(f"{backend}: not available, skipped")
+        else:
+            backends.append(backend)
+    return backends
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("pages_dir", help="directory of stored .html pages")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--download", nargs="+", metavar="URL", help="store pages first"
+    )
+    args = parser.parse_args()
+
+    if args.download:
+        save_pages(args.pages_dir, args.download)
+    pages = read_pages(args.pages_dir)
+    if not pages:
+        parser.error(f"no .html page in {args.pages_dir}")
+    size = sum(len(page) for page in pages.values())
+    print(f"{len(pages)} pages, {size / 2**20:.1f} MiB, {args.rounds} rounds\n")
+
+    backends = available_backends()
+    timings = {}
+    extracted = {}
+    for backend in backends:
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            trees = {name: parsers.parse(page, backend) for name, page in pages.items()}
+        timings[backend] = (time.perf_counter() - start) / args.rounds
+        extracted[backend] = {
+            name: extract(tree, backend) for name, tree in trees.items()
+        }
+
+    reference = timings.get("html5lib")
+    print(
+        f"{'backend':<12} {'parse (s)':>10} {'ms/page':>9} {'speedup':>8}  mismatches"
+    )
+    for backend in backends:
+        mismatches = []
+        for name, values in extracted[backend].items():
+            for key, value in values.items():
+                expected = parsers.parser_for(EXTRACTS[key])
+                if expected in extracted and extracted[expected][name][key] != value:
+                    mismatches.append(f"{name}: {key} (vs {expected})")
+        speedup = f"{reference / timings[backend]:.1f}x" if reference else "-"
+        print(
+            f"{backend:<12} {timings[backend]:>10.3f} "
+            f"{timings[backend] * 1000 / len(pages):>9.1f} {speedup:>8}  "
+            f"{len(mismatches)}"
+        )
+        for mismatch in mismatches:
+            print(f"    {mismatch}")
+
+
+if __name__ == "__main__":
+    main()
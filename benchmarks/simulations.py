@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""Time and peak memory of the PhET sim rewriter against the former soup one
+
+    python benchmarks/simulations.py [SIMS_DIR] [--rounds 3] [--sims 3]
+    python benchmarks/simulations.py SIMS_DIR --download URL [URL ...]
+
+Sims are read from the .html files of SIMS_DIR (PhET sim pages such as
+https://phet.colorado.edu/sims/html/NAME/latest/NAME_en.html, stored with
+--download), or generated when no directory is given. Both ways must keep
+the same tags, text and script code ; any sim for which they differ is
+reported. Peak memory is the peak of Python allocations while rewriting."""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+
+from simulations import offline_sim_html  # noqa: E402
+
+HEAD = (
+    "<!DOCTYPE HTML><html><head><meta charset=utf-8>"
+    '<meta name="viewport" content="width=device-width, initial-scale=1">'
+    "<title>Sim {n} &mdash; PhET</title>"
+    '<script async src="https://www.google-analytics.com/analytics.js"></script>'
+    "<!-- build <script>ignored</script> -->"
+    "</head><body>"
+)
+CODE = (
+    'function f{i}(t){{var e=this;if(t<e.x{i}&&t>0)return{{a:"{i}",b:[1,{i}]}};'
+    'return e.m{i}("<div class=\\"k\\">"+t+"</div>")}}'
+)
+MENU = (
+    'var m={{items:[{{text:"a",callback:c,tandem:t.createTandem("phetWebsiteButton"),'
+    'present:1}},{{text:"b",callback:d,tandem:t.createTandem("reportAProblem")}},'
+    '{{text:"c",callback:g,tandem:t.createTandem("getUpdate"),present:!0}},'
+    '{{text:"d",tandem:t.createTandem("about{n}")}}]}};\n'
+)
+
+
+def generated_sims(count, size=4 * 2**20):
+    rng = random.Random(0)
+    sims = {}
+    for n in range(count):
+        code = []
+        length = 0
+        while length < size:
+            chunk = CODE.format(i=rng.randint(0, 10**6))
+            if rng.random() < 0.01:
+                chunk += "\n"
+            code.append(chunk)
+            length += len(chunk)
+        code.insert(len(code) // 3, "check:function(){var t=this;return t.x};")
+        code.insert(len(code) // 2, "getLinks:function(t){return t.links};")
+        code.insert(2 * len(code) // 3, MENU.format(n=n))
+        sims[f"generated_{n}"] = (
+            HEAD.format(n=n)
+            + "<script>window.phet={chipper:{}};phet.chipper.version = '1.2.3';"
+            + "</script><script>"
+            + "".join(code)
+            + "</script><p>Loading&hellip;</p></body></html>"
+        )
+    return sims
+
+
+def save_sims(sims_dir, urls):
+    os.makedirs(sims_dir, exist_ok=True)
+    for url in urls:
+        response = requests.get(url, timeout=60)
+        name = urlparse(url).path.strip("/").replace("/", "_")
+        with open(os.path.join(sims_dir, name), "w", encoding="utf-8") as fh:
+            fh.write(response.text)
+        print(f"saved {url}")
+
+
+def read_sims(sims_dir):
+    sims = {}
+    for name in sorted(os.listdir(sims_dir)):
+        if name.endswith(".html"):
+            with open(os.path.join(sims_dir, name), encoding="utf-8") as fh:
+                sims[name] = fh.read()
+    return sims
+
+
+def soup_rewrite(content):
+    """ former PhetResource.process_sim_html: the whole sim parsed by bs4 """
+    content = content.replace(
+        "check:function(){var t=this", "check:function(){return;var t=this"
+    )
+    content = content.replace(
+        "getLinks:function(", "getLinks:function(){return [];},doNothing:function("
+    )
+    soup = BeautifulSoup(content, "html.parser")
+    for script in soup.find_all("script"):
+        if "analytics.js" in str(script):
+            script.extract()
+        if 'createTandem("phetWebsiteButton' in str(script):
+            script.string = re.compile(
+                r'\{[^}]+createTandem\("phetWebsiteButton"\).*createTandem\("getUpdate"[^\}]*\},'
+            ).sub("", script.string.replace("\n", " "))
+    return str(soup)
+
+
+def outline(html):
+    """tags with their attributes, text (whitespace collapsed: bs4 adds some
+    when serializing) and script code of html"""
+    soup = BeautifulSoup(html, "html.parser")
+    tags = [(tag.name, sorted(tag.attrs.items())) for tag in soup.find_all(True)]
+    scripts = [script.string for script in soup.find_all("script")]
+    return tags, " ".join(soup.get_text().split()), scripts
+
+
+def timed(fn, sims, rounds):
+    """ seconds per round of fn over sims, outputs of the last round """
+    elapsed = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        outputs = {name: fn(content) for name, content in sims.items()}
+        elapsed += time.perf_counter() - start
+    return elapsed / rounds, outputs
+
+
+def peak_memory(fn, sims):
+    """ largest peak of Python allocations while fn rewrites a sim """
+    peak = 0
+    for content in sims.values():
+        tracemalloc.start()
+        fn(content)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("sims_dir", nargs="?", help="directory of stored sim pages")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--sims", type=int, default=3, help="sims generated without dir"
+    )
+    parser.add_argument(
+        "--download", nargs="+", metavar="URL", help="store sim pages first"
+    )
+    args = parser.parse_args()
+
+    if args.download:
+        if not args.sims_dir:
+            parser.error("--download needs SIMS_DIR")
+        save_sims(args.sims_dir, args.download)
+    if args.sims_dir:
+        sims = read_sims(args.sims_dir)
+    else:
+        sims = generated_sims(args.sims)
+    if not sims:
+        parser.error(f"no .html sim in {args.sims_dir}")
+    size = sum(len(content) for content in sims.values())
+    print(f"{len(sims)} sims, {size / 2**20:.1f} MiB, {args.rounds} rounds\n")
+
+    rewriters = [("soup", soup_rewrite), ("tokenizer", offline_sim_html)]
+    results = {}
+    for label, fn in rewriters:
+        elapsed, outputs = timed(fn, sims, args.rounds)
+        results[label] = (elapsed, peak_memory(fn, sims), outputs)
+    expected = results["soup"][2]
+    mismatches = [
+        name
+        for name in sims
+        if outline(results["tokenizer"][2][name]) != outline(expected[name])
+    ]
+
+    soup_time = results["soup"][0]
+    print(
+        f"{'rewriter':<10} {'time (s)':>9} {'ms/sim':>9} {'speedup':>8} {'peak MiB':>9}"
+    )
+    for label, _ in rewriters:
+        elapsed, peak, _ = results[label]
+        print(
+            f"{label:<10} {elapsed:>9.3f} {elapsed * 1000 / len(sims):>9.1f} "
+            f"{soup_time / elapsed:>7.1f}x {peak / 2**20:>9.1f}"
+        )
+    print(f"\n{len(mismatches)} mismatches")
+    for name in mismatches:
+        print(f"    {name}")
+
+
+if __name__ == "__main__":
+    main()
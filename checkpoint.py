@@ -0,0 +1,186 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils import file_exists
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (key TEXT PRIMARY KEY, node TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS visited (url TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS redirects (url TEXT PRIMARY KEY, final_url TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS validators (
+    url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS topic_hierarchies (
+    subject TEXT, url TEXT, page_id TEXT NOT NULL, guid TEXT NOT NULL,
+    links TEXT NOT NULL, PRIMARY KEY (subject, url)
+);
+CREATE TABLE IF NOT EXISTS failures (
+    url TEXT PRIMARY KEY, reason TEXT NOT NULL, expires REAL NOT NULL
+);
+"""
+
+
+def node_files(node):
+    """ paths of the files of node and of its descendants """
+    thumbnail = node.get("thumbnail")
+    if thumbnail and not thumbnail.startswith("http"):
+        yield thumbnail
+    for file_ in node.get("files", []):
+        if file_.get("path"):
+            yield file_["path"]
+    for child in node.get("children", []):
+        if child is not None:
+            yield from node_files(child)
+
+
+class Checkpoint:
+    """SQLite record of a crawl's progress, written as work completes
+
+    - visited URLs and resolved redirects
+    - finished node dicts (chapters, indexes, collections) by key
+    - links of topic hierarchies by subject and page URL, with the page id
+      and guid they were read with
+    - validators (ETag, Last-Modified, content digest) of fetched pages
+    - URLs that failed permanently, until their record expires
+
+    A resumed run reuses stored nodes whose files are still on disk. An
+    incremental run keeps the previous record so that unchanged pages can be
+    reused once revalidated. A run of the assets or package stage only (keep)
+    adds to the record. Otherwise a run starts from an empty record, but for
+    failures and topic hierarchies which are kept by every run (hierarchies
+    are only reused for pages that did not change)."""
+
+    def __init__(self, path, resume=False, incremental=False, keep=False):
+        self.path = path
+        self.resume = resume
+        self.incremental = incremental
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self.conn.executescript(SCHEMA)
+            if not (resume or incremental or keep):
+                self.conn.executescript(
+                    "DELETE FROM nodes; DELETE FROM visited; DELETE FROM redirects;"
+                )
+            self.conn.execute("DELETE FROM failures WHERE expires <= ?", (time.time(),))
+            if not (resume or keep):
+                # pages fetched during this run will update validators
+                self.conn.execute("DROP TABLE IF EXISTS previous_validators")
+            # a resumed run keeps the snapshot of the run it resumes, if any
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS previous_validators AS "
+                "SELECT * FROM validators"
+            )
+
+    @staticmethod
+    def key(kind, *parts):
+        return json.dumps([kind] + list(parts))
+
+    def visit(self, url):
+        with self._lock:
+            self.conn.execute("INSERT OR IGNORE INTO visited VALUES (?)", (url,))
+
+    def visited_count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM visited").fetchone()[0]
+
+    def redirect(self, url, final_url=None):
+        """ records url's final_url if set, returns its known final URL otherwise """
+        with self._lock:
+            if final_url is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO redirects VALUES (?, ?)", (url, final_url)
+                )
+                return final_url
+            row = self.conn.execute(
+                "SELECT final_url FROM redirects WHERE url = ?", (url,)
+            ).fetchone()
+        if row is not None:
+            return row[0]
+
+    def save_node(self, key, node):
+        if node is None:
+            return
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO nodes VALUES (?, ?)", (key, json.dumps(node))
+            )
+
+    def node(self, key):
+        """ stored node for key if resuming and its files are still there """
+        if self.resume:
+            return self.stored_node(key)
+
+    def stored_node(self, key):
+        """ node stored for key if its files are still there """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT node FROM nodes WHERE key = ?", (key,)
+            ).fetchone()
+        if row is not None:
+            node = json.loads(row[0])
+            if all(file_exists(path) for path in node_files(node)):
+                return node
+
+    def save_validators(self, url, etag, last_modified, digest):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?)",
+                (url, etag, last_modified, digest),
+            )
+
+    def validators(self, url):
+        """ (etag, last_modified, digest) of url as of the previous run or None """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT etag, last_modified, digest FROM previous_validators "
+                "WHERE url = ?",
+                (url,),
+            ).fetchone()
+
+    def save_hierarchy(self, subject, url, page_id, guid, links):
+        """ links: [(text, attrs), ...] of the topic hierarchy of url's page """
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO topic_hierarchies VALUES (?, ?, ?, ?, ?)",
+                (subject, url, page_id, guid, json.dumps(links)),
+            )
+
+    def hierarchy(self, subject, url):
+        """ (page id, guid, links) of url's topic hierarchy, None if not stored """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT page_id, guid, links FROM topic_hierarchies "
+                "WHERE subject = ? AND url = ?",
+                (subject, url),
+            ).fetchone()
+        if row is not None:
+            return row[0], row[1], json.loads(row[2])
+
+    def save_failure(self, url, reason, ttl):
+        """ records that url failed permanently, for ttl seconds """
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO failures VALUES (?, ?, ?)",
+                (url, reason, time.time() + ttl),
+            )
+
+    def failure(self, url):
+        """ reason url failed permanently, None if it did not or it expired """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT reason FROM failures WHERE url = ? AND expires > ?",
+                (url, time.time()),
+            ).fetchone()
+        if row is not None:
+            return row[0]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
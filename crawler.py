@@ -0,0 +1,233 @@
+import heapq
+import itertools
+import logging
+import multiprocessing
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+LOGGER = logging.getLogger()
+
+
+class KeyedLocks:
+    """one lock per key (ie. output filepath) so that workers never write the
+    same file at the same time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = defaultdict(threading.Lock)
+
+    def __call__(self, key):
+        with self._lock:
+            return self._locks[key]
+
+
+class CrawlEngine:
+    """Runs crawl work (page fetches, chapter packaging) on a thread pool
+
+    - `workers` is the size of the pool ; 1 runs everything inline (sequential)
+    - with `processes`, CPU-bound work runs on a pool of forked processes,
+      each set up by initializer(*initargs) which resets the state they must
+      not share ; submitted functions, their arguments and results must be
+      picklable, and path_locks only hold within a process
+
+    Results are always collected in submission order so that callers building
+    `tree_nodes` get the same ordering as the sequential walk."""
+
+    def __init__(self, workers=1, processes=False, initializer=None, initargs=()):
+        self.workers = max(int(workers), 1)
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.path_locks = KeyedLocks()
+        self._executor = None
+        self._prefetched = set()
+        self._prefetched_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None and self.workers > 1:
+            if self.processes:
+                # forked: spawned processes would import ricecooker again,
+                # which clears the temp dir files are being downloaded to
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                    initializer=self.initializer,
+                    initargs=self.initargs,
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="crawl"
+                )
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """ Future of fn(*args, **kwargs) ; ran inline without a pool """
+        if self.executor is not None:
+            return self.executor.submit(fn, *args, **kwargs)
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def start(self):
+        """starts the pool ahead of any work: forked processes are then all
+        forked before other threads of the run get busy"""
+        if self.executor is not None:
+            self.executor.submit(int).result()
+
+    def map(self, fn, items):
+        """ fn applied to each item concurrently, results in items order """
+        futures = [self.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def prefetch(self, fn, url):
+        """schedules fn(url) once per url, result discarded
+
+        Used to warm up sibling pages (fn memoizes) while the sequential walk,
+        which owns the `visited_urls` bookkeeping, handles the current one"""
+        if self.executor is None:
+            return
+        with self._prefetched_lock:
+            if url in self._prefetched:
+                return
+            self._prefetched.add(url)
+        self.submit(fn, url)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._prefetched.clear()
+
+
+class WorkPools:
+    """Bounded thread pools by kind of work, each with its own queue, so that
+    slow work of a kind (video downloads) never holds up the others
+
+    `workers` is {kind: pool size} ; work of a kind without a pool runs inline"""
+
+    def __init__(self, workers=None):
+        self.workers = {kind: int(size) for kind, size in (workers or {}).items()}
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def executor(self, kind):
+        with self._lock:
+            if kind not in self._executors and self.workers.get(kind, 0) > 0:
+                self._executors[kind] = ThreadPoolExecutor(
+                    max_workers=self.workers[kind], thread_name_prefix=kind
+                )
+            return self._executors.get(kind)
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """ Future of fn(*args, **kwargs) on the pool of kind """
+        executor = self.executor(kind)
+        if executor is not None:
+            return executor.submit(fn, *args, **kwargs)
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def shutdown(self):
+        with self._lock:
+            executors, self._executors = self._executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+
+
+def _copy_outcome(target, source):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def when_done(futures, fn, *args):
+    """Future of fn(*args), called once all futures are done, on the thread
+    that completes the last of them (inline if none is pending)
+
+    the exception of the first failed future is passed on instead of calling
+    fn ; if fn returns a Future, its outcome is passed on once it is done, so
+    that no thread waits for it"""
+    futures = list(futures)
+    result = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def run():
+        for future in futures:
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+                return
+        try:
+            value = fn(*args)
+        except Exception as exc:
+            result.set_exception(exc)
+            return
+        if isinstance(value, Future):
+            value.add_done_callback(partial(_copy_outcome, result))
+        else:
+            result.set_result(value)
+
+    def done(future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            run()
+
+    if not futures:
+        run()
+    for future in futures:
+        future.add_done_callback(done)
+    return result
+
+
+class Frontier:
+    """Pending crawl work, popped according to `order`
+
+    - dfs: last pushed first (stack), same visiting order as a recursive walk
+    - bfs: first pushed first (queue)
+    - priority: lowest `priority` first, push order among equals"""
+
+    ORDERS = ("dfs", "bfs", "priority")
+
+    def __init__(self, order="dfs"):
+        if order not in self.ORDERS:
+            raise ValueError(f"Unknown crawl order: {order}")
+        self.order = order
+        self._items = deque()
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap) if self.order == "priority" else len(self._items)
+
+    def push(self, item, priority=0):
+        if self.order == "priority":
+            heapq.heappush(self._heap, (priority, next(self._counter), item))
+        else:
+            self._items.append(item)
+
+    def extend(self, items, priority=0):
+        """ pushes items so that they are popped in the given order """
+        items = list(items)
+        if self.order == "dfs":
+            items.reverse()
+        for item in items:
+            self.push(item, priority=priority)
+
+    def pop(self):
+        if self.order == "priority":
+            return heapq.heappop(self._heap)[-1]
+        if self.order == "dfs":
+            return self._items.pop()
+        return self._items.popleft()
@@ -0,0 +1,110 @@
+import json
+import os
+from urllib.parse import quote, unquote, urljoin, urlparse
+
+import xxhash
+
+# article types of pages rendered with guide tabs (books, courses): their
+# subpages are chapters, like the Topic_hierarchy links QueryPage reads
+GUIDE_ARTICLES = ("topic-guide",)
+
+
+def text(value):
+    """ text of a MindTouch JSON value: plain string or {"#text": ...} """
+    if isinstance(value, dict):
+        return value.get("#text", "")
+    return value or ""
+
+
+def tree_url(url):
+    """ pages API URL of the subtree of pages under url """
+    path = unquote(urlparse(url).path).strip("/")
+    page = quote(quote(path, safe=""), safe="")
+    return urljoin(url, "/@api/deki/pages/={}/tree?dream.out.format=json".format(page))
+
+
+class PageTree:
+    """A MindTouch page and its subpages, in site order
+
+    built from the pages API `tree` response, which holds the whole subtree
+    of a page: a bookshelf or a course in a single request"""
+
+    def __init__(self, page_id, title, url, article=None, children=None):
+        self.page_id = page_id
+        self.title = title
+        self.url = url
+        self.article = article
+        self.children = children or []
+
+    @classmethod
+    def from_json(cls, page):
+        subpages = page.get("subpages") or {}
+        children = subpages.get("page", []) if isinstance(subpages, dict) else []
+        if isinstance(children, dict):
+            children = [children]
+        return cls(
+            page.get("@id"),
+            text(page.get("title")),
+            text(page.get("uri.ui")),
+            article=text(page.get("article")) or None,
+            children=[cls.from_json(child) for child in children],
+        )
+
+    @property
+    def is_guide(self):
+        return self.article in GUIDE_ARTICLES
+
+    def descendants(self):
+        """ subpages at all depths, depth first """
+        for child in self.children:
+            yield child
+            yield from child.descendants()
+
+
+class TreeLink:
+    """ PageTree exposing the parts of bs4's Tag API used on links """
+
+    name = "a"
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.attrs = {"href": tree.url}
+
+    @property
+    def text(self):
+        return self.tree.title
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def find(self, *args, **kwargs):
+        return None
+
+
+class Fixtures:
+    """Recorded API responses, read instead of requesting the API
+
+    each response is stored as {xxh64(url)}.json in `directory` ; with
+    record=True, missing responses are requested and stored, otherwise a
+    missing response raises FileNotFoundError"""
+
+    def __init__(self, directory, record=False):
+        self.directory = directory
+        self.record = record
+
+    def path(self, url):
+        name = xxhash.xxh64(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "{}.json".format(name))
+
+    def get(self, url, fetch_fn):
+        path = self.path(url)
+        if not os.path.exists(path):
+            if not self.record:
+                raise FileNotFoundError("No recorded response for {}".format(url))
+            os.makedirs(self.directory, exist_ok=True)
+            response = fetch_fn(url)
+            with open(path, "w") as f:
+                json.dump({"url": url, "response": response}, f)
+            return response
+        with open(path) as f:
+            return json.load(f)["response"]
@@ -0,0 +1,153 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+import xxhash
+
+from httpclient import backoff
+from utils import file_exists
+
+LOGGER = logging.getLogger()
+
+# bytes written per read of a streamed body
+CHUNK_SIZE = 64 * 1024
+# request errors after which a download is resumed from what it got so far
+RESUMABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class UnexpectedType(Exception):
+    """ the response is not of an accepted content type """
+
+
+class IncompleteDownload(IOError):
+    """ the downloaded size does not match the size announced """
+
+
+def expected_size(response, offset):
+    """size of the whole file from a response starting at byte offset, None
+    if not announced or if the body is encoded (the announced size is then
+    that of the encoded body)"""
+    if response.headers.get("content-encoding", "identity") != "identity":
+        return None
+    match = CONTENT_RANGE.match(response.headers.get("content-range") or "")
+    if match is not None:
+        if match.group(3) != "*":
+            return int(match.group(3))
+        return int(match.group(2)) + 1
+    length = response.headers.get("content-length")
+    if length is not None and length.isdigit():
+        return offset + int(length)
+
+
+def ranged_download(session, url, path, accept=None, tries=4):
+    """Downloads url to path, returns path ; None if its content type is
+    not one of accept (any type if None)
+
+    - the type is checked on the response headers, before its body is read
+    - the body is written to path.part, which an interrupted download (in
+      this run or an earlier one) resumes with a Range request ; a server
+      answering with the whole file restarts it
+    - the size is checked against the announced one before path.part is
+      renamed to path
+
+    request errors are retried up to tries times, the last one is raised"""
+    part_path = path + ".part"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    for attempt in range(1, tries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = "bytes={}-".format(offset)
+        try:
+            response = session.get(url, headers=headers, stream=True)
+            try:
+                if response.status_code == 416 and offset:
+                    # nothing left after offset, or a stale .part: start over
+                    os.remove(part_path)
+                    continue
+                response.raise_for_status()
+                content_type = response.headers.get("content-type") or ""
+                if accept is not None and not any(t in content_type for t in accept):
+                    raise UnexpectedType(
+                        "{} is {}".format(url, content_type or "of no type")
+                    )
+                if response.status_code != 206:
+                    offset = 0
+                size = expected_size(response, offset)
+                with open(part_path, "ab" if offset else "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+            finally:
+                response.close()
+        except UnexpectedType as e:
+            LOGGER.info("    - Not downloaded: {}".format(e))
+            return None
+        except RESUMABLE_ERRORS:
+            if attempt == tries:
+                raise
+            time.sleep(backoff(attempt))
+            continue
+        downloaded = os.path.getsize(part_path)
+        if size is not None and downloaded < size:
+            LOGGER.info(
+                "    - {} of {} bytes of {}, resuming".format(downloaded, size, url)
+            )
+            continue
+        if size is not None and downloaded > size:
+            os.remove(part_path)
+            raise IncompleteDownload(
+                "{}: {} bytes instead of {}".format(url, downloaded, size)
+            )
+        os.replace(part_path, path)
+        return path
+    raise IncompleteDownload("{}: incomplete after {} tries".format(url, tries))
+
+
+class Downloads:
+    """Files downloaded once per URL, under `directory`
+
+    - each URL has its own directory, so that files of the same name from
+      different URLs never collide
+    - a file already downloaded (by this run or an earlier one) is reused
+      without any request
+    - concurrent requests of a URL wait for the first one, whose result,
+      a failure (None) included, is kept for the run"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._paths = {}  # url: Future of path
+
+    def path(self, url, filename):
+        url_hash = xxhash.xxh64(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, url_hash[:2], url_hash, filename)
+
+    def get(self, url, filename, download_fn):
+        """path of url's file, download_fn(url, path) downloading it to path
+        if needed and returning path, or None if it could not"""
+        with self._lock:
+            future = self._paths.get(url)
+            owner = future is None
+            if owner:
+                future = self._paths[url] = Future()
+        if not owner:
+            return future.result()
+
+        path = self.path(url, filename)
+        try:
+            if not file_exists(path):
+                path = download_fn(url, path)
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        future.set_result(path)
+        return path
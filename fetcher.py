@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+
+# a fetched page: final URL (after redirects), body bytes, status code and headers
+Page = namedtuple("Page", ["url", "body", "status", "headers"])
+
+
+class LRUFutures:
+    """bounded map of key: Future, least recently used dropped first ;
+    pinned keys are not dropped until unpinned"""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pinned = set()
+
+    def claim(self, key):
+        """ (future, owner) for key ; owner is True if caller must resolve it """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key], False
+            future = Future()
+            self._entries[key] = future
+            self._evict()
+            return future, True
+
+    def _evict(self):
+        excess = len(self._entries) - self.size
+        victims = []
+        for key in self._entries:
+            if len(victims) >= excess:
+                break
+            if key not in self._pinned:
+                victims.append(key)
+        for key in victims:
+            del self._entries[key]
+
+    def pin(self, key):
+        with self._lock:
+            self._pinned.add(key)
+
+    def unpin(self, key):
+        with self._lock:
+            self._pinned.discard(key)
+            self._evict()
+
+    def put(self, key, value):
+        with self._lock:
+            if key not in self._entries:
+                future = Future()
+                future.set_result(value)
+                self._entries[key] = future
+
+    def done(self, key):
+        """ value of key if computed, None otherwise """
+        with self._lock:
+            future = self._entries.get(key)
+        if future is not None and future.done() and future.exception() is None:
+            return future.result()
+
+    def discard(self, key, future):
+        with self._lock:
+            if self._entries.get(key) is future:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key, compute):
+        """compute(key) once while key stays in the map
+
+        concurrent callers wait for the first one ; None results and errors
+        are not kept so that callers can retry"""
+        future, owner = self.claim(key)
+        if owner:
+            try:
+                value = compute(key)
+            except Exception as exc:
+                self.discard(key, future)
+                future.set_exception(exc)
+                raise
+            if value is None:
+                self.discard(key, future)
+            future.set_result(value)
+        return future.result()
+
+
+class PageMemo:
+    """Per-run memo of fetched pages and of their parsed soups
+
+    A URL is fetched at most once (and parsed at most once per parser) while
+    it stays among the most recently used entries, or while pinned (pages
+    prefetched ahead of their use). Pages are also recorded under their
+    final (redirected) URL.
+
+    Memoized soups are shared: only read-only call sites may use them."""
+
+    def __init__(self, pages=256, soups=32):
+        self.pages = LRUFutures(pages)
+        self.soups = LRUFutures(soups)
+
+    def page(self, url, fetch_fn):
+        page = self.pages.get(url, fetch_fn)
+        if page is not None and page.url and page.url != url:
+            self.pages.put(page.url, page)
+        return page
+
+    def pin(self, url):
+        """ keeps url's page, once fetched, until unpinned """
+        self.pages.pin(url)
+
+    def unpin(self, url):
+        self.pages.unpin(url)
+
+    def remember(self, url, page):
+        self.pages.put(url, page)
+
+    def cached(self, url):
+        """ page of url if already fetched and still in the memo """
+        return self.pages.done(url)
+
+    def soup(self, url, parser, fetch_fn, parse_fn):
+        def parse(key):
+            page = self.page(url, fetch_fn)
+            if page is not None and page.body is not None:
+                return parse_fn(page.body, parser)
+
+        return self.soups.get((url, parser), parse)
+
+    def clear(self):
+        self.pages.clear()
+        self.soups.clear()
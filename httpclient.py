@@ -0,0 +1,234 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# connect, read timeouts (seconds) of requests made without one
+DEFAULT_TIMEOUT = (10, 60)
+# keep-alive pools: hosts kept connected, connections kept per host ; above
+# any per_host limit so that no connection is discarded after use
+POOL = dict(pool_connections=32, pool_maxsize=32)
+
+# responses telling a client to slow down
+THROTTLE_STATUSES = (429, 503)
+# client errors worth retrying: request timeout, too many requests
+TRANSIENT_CLIENT_ERRORS = (408, 429)
+# request errors that fail the same way when retried
+PERMANENT_ERRORS = (
+    requests.exceptions.InvalidURL,
+    requests.exceptions.MissingSchema,
+    requests.exceptions.InvalidSchema,
+    requests.exceptions.TooManyRedirects,
+    FileNotFoundError,
+)
+# outcomes of a request, for HostThrottle.release
+SUCCESS = "success"
+CACHED = "cached"
+THROTTLED = "throttled"
+FAILED = "failed"
+MIN_RATE = 0.2  # requests per second a throttled host is slowed down to
+MAX_PAUSE = 300  # seconds, longest Retry-After honored
+
+LOGGER = logging.getLogger()
+
+
+def retry_after(response):
+    """ seconds to wait from response's Retry-After header, None if unset """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def permanent_failure(exc):
+    """whether retrying the request that raised exc cannot succeed: client
+    errors (4xx but 408 and 429), invalid URLs, redirect loops, missing files"""
+    if isinstance(exc, requests.exceptions.HTTPError):
+        status = exc.response.status_code if exc.response is not None else None
+        return (
+            status is not None
+            and 400 <= status < 500
+            and status not in TRANSIENT_CLIENT_ERRORS
+        )
+    return isinstance(exc, PERMANENT_ERRORS)
+
+
+def backoff(attempt, base=1.0, cap=60.0):
+    """ seconds to sleep before retry `attempt` (0 based): full jitter """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class HostThrottle:
+    """Admission of requests to one host, adapted to how the host responds
+
+    - a token bucket caps the request rate (requests per second, `burst`
+      requests at once) ; responses served from the cache give their token
+      back
+    - at most `limit` requests are in flight, `limit` being raised by one
+      after `limit` fast successes, up to `max_limit`
+    - a throttled (429, 503), failed or slow (`slow` seconds) request halves
+      `limit` and the rate, once for all requests already in flight ;
+      Retry-After pauses the host"""
+
+    def __init__(self, max_limit=4, rate=10.0, burst=None, slow=10.0):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(max_limit, 1)
+        self.slow = slow
+        self.tokens = self.burst
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._refilled = time.monotonic()
+        self._successes = 0
+        self._decreased = 0.0
+        self._cond = threading.Condition()
+
+    def _take_token(self, now):
+        """ 0 if a token was taken, seconds until one is available otherwise """
+        if self.rate is None:
+            return 0
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0 and self.in_flight < self.limit:
+                    wait = self._take_token(now)
+                    if wait <= 0:
+                        self.in_flight += 1
+                        return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, started, outcome=None, retry_after=None):
+        """request started (monotonic time) ended with outcome: SUCCESS, CACHED,
+        THROTTLED, FAILED or None (not counted)"""
+        with self._cond:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if outcome == CACHED:
+                if self.rate is not None:
+                    self.tokens = min(self.burst, self.tokens + 1)
+            elif outcome == SUCCESS and now - started < self.slow:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self._successes = 0
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    if self.rate is not None:
+                        self.rate = min(self.max_rate, self.rate * 1.25)
+            elif outcome is not None and started >= self._decreased:
+                self._decreased = now
+                self._successes = 0
+                self.limit = max(1, self.limit // 2)
+                if self.rate is not None:
+                    self.rate = max(MIN_RATE, self.rate / 2)
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until, now + min(retry_after, MAX_PAUSE)
+                )
+            self._cond.notify_all()
+
+
+class HostLimiter:
+    """ one HostThrottle per host (netloc) """
+
+    def __init__(self, per_host=4, rate=10.0):
+        self.per_host = per_host
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._throttles = {}
+
+    def throttle(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._throttles:
+                self._throttles[host] = HostThrottle(self.per_host, rate=self.rate)
+            return self._throttles[host]
+
+    @contextmanager
+    def slot(self, url):
+        throttle = self.throttle(url)
+        throttle.acquire()
+        start = time.monotonic()
+        try:
+            yield throttle
+        finally:
+            throttle.release(start)
+
+
+class PooledSession(requests.Session):
+    """Session through which every outbound request goes
+
+    - `adapter` is mounted for http and https, built with POOL so that
+      connections to each host are kept alive and reused across threads
+    - requests without a timeout get DEFAULT_TIMEOUT
+    - requests to a host are admitted by its HostThrottle: at most
+      `per_host` in flight and `rate` per second (None: no rate limit),
+      both lowered while the host throttles, fails or slows down ; a
+      streamed response's body is read after its slot is released"""
+
+    def __init__(self, adapter=None, per_host=4, rate=10.0, timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+        self.configure(per_host, rate)
+        adapter = adapter if adapter is not None else HTTPAdapter(**POOL)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def configure(self, per_host=4, rate=10.0):
+        self.hosts = HostLimiter(max(int(per_host), 1), rate=rate)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        throttle = self.hosts.throttle(url)
+        throttle.acquire()
+        start = time.monotonic()
+        outcome, wait = None, None
+        try:
+            response = super().request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            outcome = FAILED
+            raise
+        else:
+            if response.status_code in THROTTLE_STATUSES:
+                outcome, wait = THROTTLED, retry_after(response)
+                LOGGER.info(
+                    "Throttled by {} ({}){}".format(
+                        urlparse(url).netloc,
+                        response.status_code,
+                        ", retry after {:.0f}s".format(wait) if wait else "",
+                    )
+                )
+            elif getattr(response, "from_cache", False):
+                outcome = CACHED
+            else:
+                outcome = SUCCESS
+            return response
+        finally:
+            throttle.release(start, outcome, wait)
@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import xxhash
+
+from utils import file_exists, get_name_from_url
+
+LOGGER = logging.getLogger()
+
+
+def local_filename(url, taken):
+    """name of url's image within a zip, not among taken names
+
+    the URL's basename unless another URL already uses it in this zip"""
+    filename = get_name_from_url(url)
+    if filename in taken:
+        stem, ext = os.path.splitext(filename)
+        url_hash = xxhash.xxh64(url.encode("utf-8")).hexdigest()[:8]
+        filename = "{}_{}{}".format(stem, url_hash, ext)
+    return filename
+
+
+class ContentStore:
+    """ files stored once per content hash, under `directory` """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def store(self, contents):
+        digest = xxhash.xxh64(contents).hexdigest()
+        path = self.path(digest)
+        if not file_exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # shards of a crawl may store the same page at the same time
+            tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+            with open(tmp_path, "wb") as f:
+                f.write(contents)
+            os.replace(tmp_path, path)
+        return digest
+
+    def read(self, digest):
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+
+class ImageStore(ContentStore):
+    """Run-wide, content-addressed store of chapter images
+
+    - each URL is fetched once per run, concurrent requests wait for the first
+    - contents are stored once per content hash, under `directory`
+    - a chapter's images are fetched concurrently, by up to `workers`
+
+    fetch_fn(url) returns the image bytes or raises ; failures are logged and
+    not kept so that a later reference retries."""
+
+    def __init__(self, directory, fetch_fn, workers=8):
+        super().__init__(directory)
+        self.fetch_fn = fetch_fn
+        self.workers = max(int(workers), 1)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._digests = {}  # url: Future of content digest
+
+    @property
+    def executor(self):
+        if self._executor is None and self.workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="images"
+            )
+        return self._executor
+
+    def preload(self, digests):
+        """ {url: digest} of images stored before, by an earlier run or stage """
+        with self._lock:
+            for url, digest in digests.items():
+                if url not in self._digests and file_exists(self.path(digest)):
+                    future = self._digests[url] = Future()
+                    future.set_result(digest)
+
+    def digest(self, url):
+        """ digest of url's contents, fetching it if needed ; None on failure """
+        with self._lock:
+            future = self._digests.get(url)
+            owner = future is None
+            if owner:
+                future = self._digests[url] = Future()
+        if not owner:
+            return future.result()
+
+        digest = None
+        try:
+            contents = self.fetch_fn(url)
+            if contents is not None:
+                digest = self.store(contents)
+        except Exception as exc:
+            LOGGER.info("Image not fetched {}: {}".format(url, exc))
+        if digest is None:
+            with self._lock:
+                del self._digests[url]
+        future.set_result(digest)
+        return digest
+
+    def fetch_all(self, urls):
+        """ {url: contents} of fetched urls, fetched concurrently """
+        urls = list(urls)
+        if self.executor is not None:
+            digests = list(self.executor.map(self.digest, urls))
+        else:
+            digests = [self.digest(url) for url in urls]
+        return {
+            url: self.read(digest)
+            for url, digest in zip(urls, digests)
+            if digest is not None
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,259 @@
+import json
+import os
+import sqlite3
+import threading
+
+from checkpoint import node_files
+from utils import file_exists
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY, kind TEXT NOT NULL, title TEXT NOT NULL,
+    url TEXT NOT NULL, base_path TEXT NOT NULL, digest TEXT NOT NULL, node TEXT
+);
+CREATE TABLE IF NOT EXISTS assets (
+    page_key TEXT, kind TEXT, url TEXT, result TEXT,
+    PRIMARY KEY (page_key, kind, url)
+);
+CREATE TABLE IF NOT EXISTS tree (id INTEGER PRIMARY KEY CHECK (id = 0), nodes TEXT);
+"""
+# kinds of assets whose result is a node (the others are images: a digest)
+MEDIA = ("video", "pdf", "phet")
+
+
+def placeholder(key, url):
+    """ stands for the node of the manifest page key in the crawled tree """
+    return {"source_id": url, "manifest": key}
+
+
+def shard_placeholder(url, shard):
+    """ stands for the node of url, crawled by shard, in a shard's tree """
+    return {"source_id": url, "shard": shard}
+
+
+def merge_trees(trees):
+    """crawled tree of a sharded crawl, from the trees of its shards in
+    order: the shards crawl the same nodes but for their placeholders, each
+    replaced by the node its shard crawled in the same place"""
+
+    def merge(nodes):
+        shards = [node["shard"] for node in nodes if "shard" in node]
+        if shards:
+            node = nodes[shards[0]]
+            if "shard" in node:
+                raise ValueError(
+                    "Shard {} lacks {}".format(shards[0], node["source_id"])
+                )
+            return node
+        node = nodes[0]
+        if node.get("children"):
+            node = dict(node, children=merge_lists([n["children"] for n in nodes]))
+        return node
+
+    def merge_lists(lists):
+        if any(len(nodes) != len(lists[0]) for nodes in lists):
+            raise ValueError("Shards crawled different trees")
+        return [merge(list(nodes)) for nodes in zip(*lists)]
+
+    return merge_lists(trees)
+
+
+def resolve(node, packaged):
+    """node with its placeholders replaced by packaged[key] ; children
+    resolved to None are dropped"""
+    if node is None:
+        return None
+    if "manifest" in node:
+        return packaged.get(node["manifest"])
+    if node.get("children"):
+        children = [resolve(child, packaged) for child in node["children"]]
+        node = dict(node, children=[child for child in children if child is not None])
+    return node
+
+
+class Manifest:
+    """SQLite record of what a staged run crawled, for its later stages
+
+    - manifest stage: the pages to package (chapters, agendas) with the
+      digest of their stored HTML, the assets they reference (images,
+      videos, PDFs, PhET simulations) and the crawled tree, in which pages
+      are placeholders
+    - assets stage: the result of each asset, the digest of an image or the
+      node of a media file ; assets without a result are fetched again
+    - package stage: the node of each packaged page
+
+    Only a manifest stage not resuming starts from an empty manifest, so that
+    the other stages can be rerun on their own. A sharded manifest stage
+    records each shard in its own manifest, merged into one (see merge) for
+    the other stages."""
+
+    def __init__(self, path, reset=False):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self.conn.executescript(SCHEMA)
+            if reset:
+                self.conn.executescript(
+                    "DELETE FROM pages; DELETE FROM assets; DELETE FROM tree;"
+                )
+
+    def add_page(self, key, kind, title, url, base_path, digest, assets):
+        """records a page and its assets [(kind, url), ...] ; results of the
+        assets of a page whose HTML did not change are kept"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT digest FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            self.conn.execute("BEGIN")
+            if row is None or row[0] != digest:
+                self.conn.execute("DELETE FROM assets WHERE page_key = ?", (key,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                (key, kind, title, url, base_path, digest),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO assets VALUES (?, ?, ?, NULL)",
+                [(key, asset_kind, asset_url) for asset_kind, asset_url in assets],
+            )
+            self.conn.execute("COMMIT")
+
+    def has_page(self, key):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None
+
+    def pages(self):
+        """ (key, kind, title, url, base_path, digest) of pages, in crawl order """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT key, kind, title, url, base_path, digest FROM pages "
+                "ORDER BY rowid"
+            ).fetchall()
+
+    def save_tree(self, nodes):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tree VALUES (0, ?)", (json.dumps(nodes),)
+            )
+
+    def tree(self):
+        """ crawled nodes, None if no manifest stage completed """
+        with self._lock:
+            row = self.conn.execute("SELECT nodes FROM tree").fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+    def pending_assets(self):
+        """ (page key, kind, url, page title, page base_path) of assets to fetch """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT a.page_key, a.kind, a.url, p.title, p.base_path "
+                "FROM assets a JOIN pages p ON p.key = a.page_key "
+                "WHERE a.result IS NULL ORDER BY a.rowid"
+            ).fetchall()
+
+    def save_asset(self, page_key, kind, url, result):
+        """ result: digest of an image, node of a media file """
+        if result is None:
+            return
+        with self._lock:
+            self.conn.execute(
+                "UPDATE assets SET result = ? "
+                "WHERE page_key = ? AND kind = ? AND url = ?",
+                (json.dumps(result), page_key, kind, url),
+            )
+
+    def image_digests(self, page_key):
+        """ {url: digest} of the fetched images of a page """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT url, result FROM assets "
+                "WHERE page_key = ? AND kind = 'image' AND result IS NOT NULL",
+                (page_key,),
+            ).fetchall()
+        return {url: json.loads(result) for url, result in rows}
+
+    def media_nodes(self, page_key):
+        """ {kind: [node, ...]} of the fetched media of a page """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT kind, result FROM assets "
+                "WHERE page_key = ? AND result IS NOT NULL ORDER BY rowid",
+                (page_key,),
+            ).fetchall()
+        nodes = {kind: [] for kind in MEDIA}
+        for kind, result in rows:
+            if kind in nodes:
+                nodes[kind].append(json.loads(result))
+        return nodes
+
+    def counts(self):
+        """ (pages, assets, fetched assets) """
+        with self._lock:
+            pages = self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            assets, fetched = self.conn.execute(
+                "SELECT COUNT(*), COUNT(result) FROM assets"
+            ).fetchone()
+        return pages, assets, fetched
+
+    def save_node(self, key, node):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE pages SET node = ? WHERE key = ?", (json.dumps(node), key)
+            )
+
+    def packaged_node(self, key):
+        """node a previous package stage produced for key if its files are
+        still there, None otherwise"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT node FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+        if row is not None and row[0] is not None:
+            node = json.loads(row[0])
+            if node is not None and all(file_exists(path) for path in node_files(node)):
+                return node
+
+    def merge(self, paths):
+        """replaces this manifest by the manifests of the shards at paths,
+        in shard order ; each shard must have completed its manifest stage"""
+        trees = []
+        for path in paths:
+            shard = Manifest(path)
+            try:
+                tree = shard.tree()
+            finally:
+                shard.close()
+            if tree is None:
+                raise RuntimeError("No crawled tree in {}".format(path))
+            trees.append(tree)
+        with self._lock:
+            self.conn.executescript(
+                "DELETE FROM pages; DELETE FROM assets; DELETE FROM tree;"
+            )
+            for path in paths:
+                self.conn.execute("ATTACH DATABASE ? AS shard", (path,))
+                try:
+                    self.conn.execute("BEGIN")
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO pages "
+                        "SELECT * FROM shard.pages ORDER BY rowid"
+                    )
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO assets "
+                        "SELECT * FROM shard.assets ORDER BY rowid"
+                    )
+                    self.conn.execute("COMMIT")
+                finally:
+                    self.conn.execute("DETACH DATABASE shard")
+        self.save_tree(merge_trees(trees))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
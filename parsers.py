@@ -0,0 +1,128 @@
+import logging
+
+from bs4 import BeautifulSoup, Tag
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    # selectolax is optional, only usable for read-only link extraction
+    HTMLParser = None
+
+LOGGER = logging.getLogger()
+
+BACKENDS = ["html5lib", "lxml", "html.parser", "selectolax"]
+
+# parser backend of each call site
+PARSERS = {
+    "browser": "html5lib",  # Browser.run: collections and topics links
+    "topic": "html5lib",  # Topic.to_soup
+    "index": "html5lib",  # CourseIndex.to_soup
+    "link": "html.parser",  # page behind an index link, read by QueryPage
+    "chapter": "html.parser",  # AgendaOrFlatPage and Chapter, cleaned and packaged
+    "api": "html.parser",  # QueryPage's topic hierarchy body
+}
+
+# call sites which only read links and thus can use selectolax
+LINKS_ONLY = ["browser"]
+
+
+def configure(spec):
+    """set PARSERS from spec
+
+    either a single backend for all sites (`lxml`) or comma-separated
+    site=backend pairs (`index=lxml,browser=selectolax`)"""
+    if not spec:
+        return
+    if "=" in spec:
+        pairs = [pair.split("=", 1) for pair in spec.split(",")]
+    else:
+        pairs = [(site, spec) for site in PARSERS]
+    for site, backend in pairs:
+        site, backend = site.strip(), backend.strip()
+        if site not in PARSERS:
+            raise ValueError(f"Unknown parser call site: {site}")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown parser backend: {backend}")
+        if backend == "selectolax":
+            if site not in LINKS_ONLY:
+                # keep site's parser when set for all sites
+                if "=" in spec:
+                    raise ValueError(f"selectolax can't be used for {site}")
+                continue
+            if HTMLParser is None:
+                LOGGER.warning(
+                    "selectolax not installed, keeping {}".format(PARSERS[site])
+                )
+                continue
+        PARSERS[site] = backend
+
+
+def parser_for(site):
+    return PARSERS[site]
+
+
+def parse(document, backend):
+    """ parsed document: a BeautifulSoup or a selectolax tree """
+    if backend == "selectolax":
+        return HTMLParser(document)
+    return BeautifulSoup(document, backend)
+
+
+class Link:
+    """ selectolax node exposing the parts of bs4's Tag API used on links """
+
+    def __init__(self, node):
+        self.node = node
+        self.name = node.tag
+        self.attrs = {
+            key: (value or "").split() if key == "class" else (value or "")
+            for key, value in node.attributes.items()
+        }
+
+    @property
+    def text(self):
+        return self.node.text(deep=True)
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def find(self, name):
+        node = self.node.css_first(name)
+        if node is not None:
+            return Link(node)
+
+
+class StoredLink:
+    """Link kept as its text and attributes, exposing the parts of bs4's Tag
+    API used on links"""
+
+    name = "a"
+
+    def __init__(self, text, attrs):
+        self.text = text
+        self.attrs = attrs
+
+    @classmethod
+    def from_tag(cls, tag, keys=("href", "title")):
+        return cls(tag.text, {key: tag.attrs[key] for key in keys if key in tag.attrs})
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def find(self, *args, **kwargs):
+        return None
+
+
+def find_links(tree, *selectors):
+    """ <a /> within nested selectors (tag, class), from a bs4 or selectolax tree """
+    node = tree
+    for tag, class_ in selectors:
+        if isinstance(node, Tag):
+            node = node.find(tag, class_=class_)
+        else:
+            node = node.css_first(f"{tag}.{class_}")
+        if node is None:
+            return []
+    if isinstance(node, Tag):
+        return node.find_all("a")
+    return [Link(a) for a in node.css("a")]
@@ -0,0 +1,168 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future
+from urllib.parse import urlparse
+
+import xxhash
+from ricecooker.utils.zip import create_predictable_zip
+
+from utils import file_exists
+
+# /sims/html/<sim>/<version>/<sim>_<lang>.html, <version> being "latest" or a
+# release such as 1.2.3
+URL_VERSION = re.compile(r"^\d+(\.\d+)+[\w.-]*$")
+# release of a sim, set in its HTML by PhET's build tools (chipper)
+HTML_VERSION = re.compile(r"phet\.chipper\.version\s*=\s*['\"]([^'\"]+)['\"]")
+
+
+# what a rewriter looks for outside scripts: a comment, or the start tag of a
+# script (quoted attribute values may hold ">")
+SIM_TOKEN = re.compile(r"<!--|<script\b(?:[^>\"']|\"[^\"]*\"|'[^']*')*>", re.IGNORECASE)
+SCRIPT_END = re.compile(r"</script\s*>", re.IGNORECASE)
+# menu entries linking to PhET's website, within a script's code
+WEBSITE_BUTTON = 'createTandem("phetWebsiteButton'
+WEBSITE_MENU = re.compile(
+    r'\{[^}]+createTandem\("phetWebsiteButton"\).*createTandem\("getUpdate"[^\}]*\},'
+)
+
+
+def without_online_checks(text):
+    """ text of a sim without its "are we online" check and "about" links """
+    # remove "are we online" check
+    text = text.replace(
+        "check:function(){var t=this", "check:function(){return;var t=this"
+    )
+    # remove online links from "about" modal
+    return text.replace(
+        "getLinks:function(", "getLinks:function(){return [];},doNothing:function("
+    )
+
+
+def offline_sim_html(content):
+    """sim HTML content without the code that makes requests to online
+    resources: the "are we online" check, the links of the "about" modal,
+    Google Analytics and the menu entries linking to PhET's website
+
+    scripts are found by a tokenizer (comments, script start and end tags)
+    and rewritten in place: the rest of the HTML is copied as is, without
+    building a DOM of its megabytes of JS. Each piece is copied once: the
+    replacements, which hold no tag, are made piece by piece"""
+    parts = []
+    pos = 0
+    while True:
+        token = SIM_TOKEN.search(content, pos)
+        if token is None:
+            break
+        if token.group(0) == "<!--":
+            comment_end = content.find("-->", token.end())
+            if comment_end == -1:
+                break
+            parts.append(without_online_checks(content[pos : comment_end + 3]))
+            pos = comment_end + 3
+            continue
+        end = SCRIPT_END.search(content, token.end())
+        if end is None:
+            break
+        parts.append(without_online_checks(content[pos : token.start()]))
+        code_start, code_end = token.end(), end.start()
+        if "analytics.js" in token.group(0) or (
+            content.find("analytics.js", code_start, code_end) != -1
+        ):
+            # Google Analytics and online image bug requests
+            pass
+        elif content.find(WEBSITE_BUTTON, code_start, code_end) != -1:
+            # menu options that link to online resources
+            code = without_online_checks(content[code_start:code_end])
+            code = WEBSITE_MENU.sub("", code.replace("\n", " "))
+            parts.append(token.group(0) + code + end.group(0))
+        else:
+            parts.append(without_online_checks(content[token.start() : end.end()]))
+        pos = end.end()
+    parts.append(without_online_checks(content[pos:]))
+    return "".join(parts)
+
+
+def url_version(url):
+    """ release of the sim at url if its URL names one, None for "latest" """
+    parts = urlparse(url).path.strip("/").split("/")
+    if len(parts) >= 2 and URL_VERSION.match(parts[-2]):
+        return parts[-2]
+
+
+def html_version(content):
+    """ release of a sim read from its HTML, its digest if not found """
+    match = HTML_VERSION.search(content)
+    if match is not None:
+        return match.group(1)
+    return xxhash.xxh64(content.encode("utf-8")).hexdigest()
+
+
+def zip_simulation(content):
+    """path of a predictable zip of the sim HTML content as its index.html,
+    in the temp dir ; the directory it was zipped from is removed"""
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "index.html"), "wb") as f:
+            f.write(content.encode("utf-8"))
+        return create_predictable_zip(directory)
+
+
+class SimulationCache:
+    """Zipped PhET simulations, stored once per sim URL and version
+
+    - a zip is built (its HTML processed and zipped) once per version of a
+      sim, under `directory`, and its path is handed out to every node
+      embedding that sim
+    - a sim whose URL names its release is reused without any request ; for
+      "latest", its HTML is requested once per run to read its version
+    - concurrent requests of a URL wait for the first one, whose result or
+      error is kept for the run"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._paths = {}  # url: Future of zip path
+
+    def path(self, url, version):
+        digest = xxhash.xxh64("{} {}".format(url, version).encode("utf-8"))
+        digest = digest.hexdigest()
+        return os.path.join(self.directory, digest[:2], "{}.zip".format(digest))
+
+    def get(self, url, fetch_fn, process_fn):
+        """path of the zip of the sim at url ; fetch_fn(url) returns its HTML,
+        process_fn(html) the HTML to zip"""
+        with self._lock:
+            future = self._paths.get(url)
+            owner = future is None
+            if owner:
+                future = self._paths[url] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            path = self.build(url, fetch_fn, process_fn)
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        future.set_result(path)
+        return path
+
+    def build(self, url, fetch_fn, process_fn):
+        content = None
+        version = url_version(url)
+        if version is None:
+            content = fetch_fn(url)
+            version = html_version(content)
+        path = self.path(url, version)
+        if file_exists(path):
+            return path
+        if content is None:
+            content = fetch_fn(url)
+        zip_path = zip_simulation(process_fn(content))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        shutil.move(zip_path, tmp_path)
+        os.replace(tmp_path, path)
+        return path
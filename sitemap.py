@@ -0,0 +1,146 @@
+import gzip
+import threading
+import xml.etree.ElementTree as ET
+from collections import Counter
+from urllib.parse import unquote, urlparse
+
+import xxhash
+
+SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+
+def iter_locs(stream):
+    """(kind, loc) of a sitemap read from a binary stream, kind being
+    "sitemap" (in a sitemap index) or "url"
+
+    parsed incrementally: entries are dropped from the root once read, so
+    memory does not grow with the size of the sitemap"""
+    root = None
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event == "start":
+            continue
+        tag = elem.tag.replace(SITEMAP_NS, "")
+        if tag in ("sitemap", "url"):
+            loc = elem.findtext(SITEMAP_NS + "loc") or elem.findtext("loc")
+            if loc:
+                yield tag, loc.strip()
+            root.clear()
+
+
+def read_sitemaps(url, open_fn):
+    """page URLs listed by the sitemap at url, following sitemap indexes
+
+    open_fn(url) returns a binary stream of a sitemap ; gzipped sitemaps
+    (.gz) are decompressed on the fly"""
+    pending = [url]
+    seen = set()
+    while pending:
+        sitemap_url = pending.pop(0)
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+        stream = open_fn(sitemap_url)
+        if sitemap_url.endswith(".gz"):
+            stream = gzip.GzipFile(fileobj=stream)
+        try:
+            for kind, loc in iter_locs(stream):
+                if kind == "sitemap":
+                    pending.append(loc)
+                else:
+                    yield loc
+        finally:
+            stream.close()
+
+
+def page_path(url):
+    """ path of url's page, unquoted and without trailing slash """
+    return unquote(urlparse(url).path).rstrip("/")
+
+
+def shard_of(url, shards):
+    """ shard (0 based) out of shards that url's page belongs to """
+    return xxhash.xxh64(page_path(url).encode("utf-8")).intdigest() % shards
+
+
+
+class Plan:
+    """Pages of a site known up front, from its sitemap
+
+    - pages are kept if in `collections` (first path segment: Bookshelves,
+      Courses...), all pages if None
+    - a page without planned subpages is a leaf, packaged as a chapter
+      without loading it as an index first
+    - pages are marked as done as the crawl reaches them, for progress"""
+
+    def __init__(self, collections=None):
+        self.collections = collections
+        self.pages = set()
+        self.descendants = Counter()  # page path: number of planned subpages
+        self._done = set()
+        self._lock = threading.Lock()
+
+    def add(self, url):
+        self.add_path(page_path(url))
+
+    def add_path(self, path):
+        """ adds a page by its path (see page_path) """
+        if not path or path in self.pages:
+            return
+        collection = path.strip("/").split("/")[0]
+        if self.collections is not None and collection not in self.collections:
+            return
+        self.pages.add(path)
+        parent = path
+        while "/" in parent.lstrip("/"):
+            parent = parent.rsplit("/", 1)[0]
+            self.descendants[parent] += 1
+
+    def extend(self, urls):
+        for url in urls:
+            self.add(url)
+        return self
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __contains__(self, url):
+        return page_path(url) in self.pages
+
+    def collection(self, url):
+        parts = page_path(url).strip("/").split("/")
+        if self.collections is None or parts[0] in self.collections:
+            return parts[0]
+
+    def is_leaf(self, url):
+        """ whether url is a planned page without planned subpages """
+        path = page_path(url)
+        return path in self.pages and self.descendants[path] == 0
+
+    def done(self, url):
+        """ marks url as reached, returns the number of planned pages reached """
+        path = page_path(url)
+        with self._lock:
+            if path in self.pages:
+                self._done.add(path)
+            return len(self._done)
+
+    def summary(self):
+        """ number of planned pages by collection """
+        return Counter(path.strip("/").split("/")[0] for path in self.pages)
+
+    def save(self, path):
+        """ writes the planned pages, one path per line """
+        with open(path, "w") as f:
+            for page in sorted(self.pages):
+                f.write(page + "\n")
+
+    @classmethod
+    def load(cls, path, collections=None):
+        """ plan saved to path ; its lines are paths, not parsed as URLs """
+        plan = cls(collections)
+        with open(path) as f:
+            for line in f:
+                plan.add_path(line.rstrip("\n"))
+        return plan
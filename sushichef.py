@@ -7,11 +7,12 @@ import json
 import time
 import imghdr
 import logging
-import tempfile
 from io import BytesIO
 from urllib.error import URLError
 from urllib.parse import urljoin, urlparse
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from functools import partial
+from concurrent.futures import Future
 
 import xxhash
 import yt_dlp
@@ -20,24 +21,32 @@ from bs4 import BeautifulSoup
 from le_utils.constants import licenses, content_kinds, file_formats
 from ricecooker.classes.licenses import get_license
 from ricecooker.chefs import JsonTreeChef
-from ricecooker.utils import downloader, html_writer
-from ricecooker.utils.caching import (
-    CacheForeverHeuristic,
-    FileCache,
-    CacheControlAdapter,
-)
-from ricecooker.utils.html import download_file
+from ricecooker.utils import downloader
 from ricecooker.utils.jsontrees import write_tree_to_json_tree, SUBTITLES_FILE
-from ricecooker.utils.zip import create_predictable_zip
-
-from utils import remove_src_set, get_name_from_url, build_path
-from utils import file_exists, remove_links
-from utils import remove_iframes
-from utils import link_to_text, remove_scripts
 
+from utils import get_name_from_url, build_path
+from utils import file_exists
+from utils import ContentWalk
+from crawler import CrawlEngine, Frontier, WorkPools, when_done
+from discovery import Fixtures, PageTree, TreeLink, tree_url
+from httpclient import POOL, PooledSession, backoff, permanent_failure
+from fetcher import Page, PageMemo
+from archive import AssetBundle, ZipAssembly
+from images import ContentStore, ImageStore, local_filename
+from checkpoint import Checkpoint
+from manifest import Manifest, placeholder, resolve, shard_placeholder
+from webcache import PackedCache, PolicyCacheAdapter
+import parsers
+from parsers import StoredLink, find_links, parser_for
+from sitemap import Plan, read_sitemaps, shard_of
+from downloads import Downloads, IncompleteDownload, ranged_download
+from simulations import SimulationCache, offline_sim_html, zip_simulation
+from videos import VideoRegistry, video_record
+
+# the crawl itself is iterative but bs4 serializes deeply nested chapter
+# content recursively
 sys.setrecursionlimit(1200)
 
-
 requests.packages.urllib3.disable_warnings()
 requests.packages.urllib3.util.ssl_.DEFAULT_CIPHERS += ":HIGH:!DH:!aNULL"
 try:
@@ -63,11 +72,86 @@ LOGGER.setLevel(logging.INFO)
 DOWNLOAD_VIDEOS = True
 DOWNLOAD_FILES = True
 OVERWRITE = True
-
-sess = requests.Session()
-cache = FileCache(".webcache")
-basic_adapter = CacheControlAdapter(cache=cache)
-forever_adapter = CacheControlAdapter(heuristic=CacheForeverHeuristic(), cache=cache)
+# only regenerate chapters which changed since the previous run
+INCREMENTAL = False
+
+MATHJAX_PATH = "../MathJax-2.7.5/"
+MATHJAX_DEPENDENCES = [
+    "config/TeX-AMS_HTML.js",
+    "jax/input/TeX/config.js",
+    "jax/input/MathML/config.js",
+    "jax/output/SVG/config.js",
+    "extensions/tex2jax.js",
+    "extensions/mml2jax.js",
+    "extensions/MathMenu.js",
+    "extensions/MathZoom.js",
+    "extensions/TeX/autobold.js",
+    "extensions/TeX/mhchem.js",
+    "extensions/TeX/color.js",
+    "extensions/TeX/boldsymbol.js",
+    "extensions/TeX/cancel.js",
+    "jax/output/HTML-CSS/jax.js",
+    "jax/output/HTML-CSS/fonts/TeX/fontdata.js",
+    "jax/output/HTML-CSS/autoload/mtable.js",
+    # "jax/output/HTML-CSS/imageFonts.js"
+]
+
+# static files copied into every zip, see load_assets()
+CSS_JS_ASSETS = None
+MATHJAX_ASSETS = None
+MATHJAX_JS_ASSETS = None  # see load_mathjax_js()
+MATHJAX_JS_PATH = "chefdata/MathJax.js"
+# src of the MathJax.js script of a chapter's HTML
+MATHJAX_JS_SRC = re.compile(rb"<script\b[^>]*\bsrc=[\"']([^\"']*MathJax\.js[^\"']*)")
+
+# web cache and its adapter, opened by LibreTextsChef.run() (see open_cache):
+# importing this module creates no file
+cache = None
+cache_adapter = None
+# every outbound request goes through sess, per_host set from --per-host
+sess = PooledSession()
+
+# attempts at fetching a page before giving up
+FETCH_TRIES = 8
+# seconds a permanently failed URL is skipped for, set from --failure-ttl-days
+FAILURE_TTL = 7 * 24 * 3600
+
+# sequential until configured from --crawl-workers in scrape()
+CRAWLER = CrawlEngine()
+# media downloads by kind of MEDIA_NODES, inline until configured from
+# --video-workers, --document-workers and --simulation-workers in scrape()
+MEDIA_POOLS = WorkPools()
+CRAWL_ORDER = "dfs"
+MAX_DEPTH = None
+# how course indexes are explored: "html" (page by page) or "api" (pages tree)
+DISCOVERY = "html"
+# recorded MindTouch API responses (discovery.Fixtures) replayed if set
+API_FIXTURES = None
+# pages known from the sitemap (sitemap.Plan), set from --sitemap in scrape()
+PLAN = None
+# (shard, shards): only the course indexes of this shard are crawled, into
+# its own checkpoint and manifest (see shard_path)
+SHARD = None
+# pages (and read-only soups) fetched during this run
+PAGES = PageMemo()
+# chapter images fetched during this run, set up in scrape()
+IMAGES = None
+# progress of this run (and of the one it resumes), set up in scrape()
+CHECKPOINT = None
+# stages of a run, see LibreTextsChef.scrape() ; "all" runs them in order but
+# "merge", which gathers the manifests of a sharded manifest stage
+STAGES = ("manifest", "merge", "assets", "package")
+# pages to package and their assets, recorded by the manifest stage
+MANIFEST = None
+# HTML of the pages of MANIFEST, by content
+PAGE_STORE = None
+# YouTube videos downloaded, by id (videos.VideoRegistry), set up in scrape()
+VIDEOS = None
+# documents downloaded, once per URL (downloads.Downloads), set up in scrape()
+DOCUMENTS = None
+# zipped PhET simulations, once per version (simulations.SimulationCache),
+# set up in scrape()
+SIMULATIONS = None
 
 
 """
@@ -168,18 +252,33 @@ def hashed(string_to_hash):
     return xxhash.xxh64(string_to_hash.encode("utf-8")).hexdigest()
 
 
+# per-request parts of a page, left out of its digest
+VOLATILE_RE = re.compile(rb'<script[^>]*id="mt-global-settings".*?</script>', re.S)
+
+
+def content_digest(body):
+    """ digest of a page's body, stable across requests of the same revision """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return xxhash.xxh64(VOLATILE_RE.sub(b"", body)).hexdigest()
+
+
 class Browser:
     def __init__(self, url):
         self.url = url
 
     def run(self):
         """ returns all link nodes from URL """
-        document = download(self.url)
-        if document is not None:
-            soup = BeautifulSoup(document, "html5lib")  # html.parser
-        section = soup.find("section", class_="mt-content-container")
-        section_div = section.find("div", class_="noindex")
-        for tag_a in section_div.find_all("a"):
+        soup = page_soup(self.url, parser_for("browser"))
+        yield from self.links(soup)
+
+    @staticmethod
+    def links(soup):
+        """ link nodes of a page's content, bs4 Tags or selectolax Links """
+        section_links = find_links(
+            soup, ("section", "mt-content-container"), ("div", "noindex")
+        )
+        for tag_a in section_links:
             if not (tag_a.text or tag_a.attrs.get("title")):
                 # Ignore links without text / title, they correspond to the
                 # image and have already been found with the title
@@ -242,11 +341,18 @@ class Collection:
             LOGGER.error("Collection Not Found: {}".format(self.title))
         else:
             LOGGER.info(self.title)
+            key = Checkpoint.key("collection", self.title, self.source_id)
+            node = CHECKPOINT.node(key)
+            if node is not None:
+                LOGGER.info("Resumed collection {}".format(self.title))
+                return node
             topic = Topic(self.source_id)
             topic.thumbnail = self.thumbnail_url
             topic.populate_thumbnails()
             topic.units()
-            return topic.to_node()
+            node = topic.to_node()
+            CHECKPOINT.save_node(key, node)
+            return node
 
 
 class Topic(object):
@@ -264,9 +370,7 @@ class Topic(object):
         LOGGER.info("- " + self.title)
 
     def to_soup(self):
-        document = download(self.source_id)
-        if document is not None:
-            return BeautifulSoup(document, "html5lib")  # html5lib
+        return page_soup(self.source_id, parser_for("topic"))
 
     def __iter__(self):
         return self.urls
@@ -311,18 +415,19 @@ class CourseLibreTexts(Topic):
         for url in self:
             topic = Topic(url.attrs.get("href"), title=url.text)
             for link in topic:
-                course_index = CourseIndex(
-                    link.text or link.attrs.get("title"), link.attrs.get("href")
-                )
-                course_index.description = link.attrs.get("title")
                 path = [
                     DATA_DIR,
                     DATA_DIR_SUBJECT,
                     hashed(topic.title),
                     hashed(link.text),
                 ]
-                course_index.index(build_path(path))
-                topic.add_node(course_index.to_node())
+                node = course_index_node(
+                    link.text or link.attrs.get("title"),
+                    link.attrs.get("href"),
+                    build_path(path),
+                    description=link.attrs.get("title"),
+                )
+                topic.add_node(node)
             self.add_node(topic.to_node())
 
 
@@ -335,16 +440,16 @@ class TextBooksTextMaps(Topic):
     def units(self):
         base_path = [DATA_DIR, DATA_DIR_SUBJECT, hashed(self.title)]
         for chapter_link in self:
-            course_index = CourseIndex(
+            node = course_index_node(
                 chapter_link.text or chapter_link.attrs.get("title"),
                 chapter_link.attrs.get("href", ""),
+                build_path(base_path + [hashed(chapter_link.text)]),
+                description=chapter_link.attrs.get("title"),
+                thumbnail=self.thumbnails_links.get(
+                    chapter_link.attrs.get("href", ""), None
+                ),
             )
-            course_index.description = chapter_link.attrs.get("title")
-            course_index.thumbnail = self.thumbnails_links.get(
-                chapter_link.attrs.get("href", ""), None
-            )
-            course_index.index(build_path(base_path + [hashed(chapter_link.text)]))
-            self.add_node(course_index.to_node())
+            self.add_node(node)
 
 
 class HomeworkExercices(Topic):
@@ -356,16 +461,16 @@ class HomeworkExercices(Topic):
     def units(self):
         base_path = [DATA_DIR, DATA_DIR_SUBJECT, hashed(self.title)]
         for chapter_link in self:
-            course_index = CourseIndex(
+            node = course_index_node(
                 chapter_link.text or chapter_link.attrs.get("title"),
                 chapter_link.attrs.get("href", ""),
+                build_path(base_path + [hashed(chapter_link.text)]),
+                description=chapter_link.attrs.get("title"),
+                thumbnail=self.thumbnails_links.get(
+                    chapter_link.attrs.get("href", ""), None
+                ),
             )
-            course_index.description = chapter_link.attrs.get("title")
-            course_index.thumbnail = self.thumbnails_links.get(
-                chapter_link.attrs.get("href", ""), None
-            )
-            course_index.index(build_path(base_path + [hashed(chapter_link.text)]))
-            self.add_node(course_index.to_node())
+            self.add_node(node)
 
 
 class Homework(HomeworkExercices):  # Alias for homework and exercices
@@ -383,16 +488,16 @@ class VisualizationPhEt(Topic):
                 "GeoGebra Simulations",
             ]:
                 continue
-            course_index = CourseIndex(
+            node = course_index_node(
                 chapter_link.text or chapter_link.attrs.get("title"),
                 chapter_link.attrs.get("href", ""),
+                build_path(base_path + [hashed(chapter_link.text)]),
+                description=chapter_link.attrs.get("title"),
+                thumbnail=self.thumbnails_links.get(
+                    chapter_link.attrs.get("href", ""), None
+                ),
             )
-            course_index.description = chapter_link.attrs.get("title")
-            course_index.thumbnail = self.thumbnails_links.get(
-                chapter_link.attrs.get("href", ""), None
-            )
-            course_index.index(build_path(base_path + [hashed(chapter_link.text)]))
-            self.add_node(course_index.to_node())
+            self.add_node(node)
 
 
 class VisualizationsSimulations(VisualizationPhEt):
@@ -420,7 +525,7 @@ def save_thumbnail(url, title):
 
     returns filepath if suceeded or None"""
     try:
-        r = requests.get(url)
+        r = sess.get(url)
     except Exception:
         return None
     else:
@@ -435,8 +540,116 @@ def save_thumbnail(url, title):
             return filepath
 
 
+def course_index_node(title, url, base_path, description=None, thumbnail=None):
+    """ node of the CourseIndex at url, crawled into base_path """
+    if SHARD is not None:
+        shard = shard_of(url, SHARD[1])
+        if shard != SHARD[0]:
+            # crawled by another shard, see manifest.merge_trees
+            return shard_placeholder(url, shard)
+    key = Checkpoint.key("index", base_path, url)
+    node = CHECKPOINT.node(key)
+    if node is not None:
+        LOGGER.info("Resumed course index {}".format(title))
+        return node
+    course_index = CourseIndex(title, url)
+    if DISCOVERY == "api" and course_index.soup is not None:
+        course_index.tree = page_tree(
+            course_index.source_id, api_token(course_index.soup)
+        )
+    course_index.description = description
+    course_index.thumbnail = thumbnail
+    course_index.index(base_path)
+    node = course_index.to_node()
+    CHECKPOINT.save_node(key, node)
+    if PLAN is not None:
+        LOGGER.info(
+            "Crawled {}: {} of {} planned pages".format(
+                title, PLAN.done(url), len(PLAN)
+            )
+        )
+    return node
+
+
+def previous_node(key, url):
+    """ node of key from the previous run if its page did not change since """
+    node = CHECKPOINT.node(key)
+    if node is None and INCREMENTAL:
+        node = CHECKPOINT.stored_node(key)
+        if node is not None and page_changed(url):
+            node = None
+    return node
+
+
+def package_chapter(title, url, base_path, thumbnail=None):
+    """Chapter node for url, its zip written into base_path ; recorded in
+    MANIFEST for the later stages if set
+
+    runs on CRAWLER's workers so sibling chapters are fetched concurrently"""
+    key = Checkpoint.key("chapter", base_path, title, url)
+    if PLAN is not None:
+        PLAN.done(url)
+    node = previous_node(key, url)
+    if node is None and MANIFEST is not None:
+        node = record_page(key, "chapter", title, url, base_path)
+    elif node is None:
+        chapter = Chapter(title, url)
+        chapter.thumbnail = thumbnail
+        chapter.to_file(base_path)
+        node = chapter.to_node()
+        CHECKPOINT.save_node(key, node)
+    return node
+
+
+def package_agenda(title, url, base_path):
+    """ AgendaOrFlatPage node for url, its zip written into base_path """
+    key = Checkpoint.key("agenda", base_path, title, url)
+    node = previous_node(key, url)
+    if node is None and MANIFEST is not None:
+        node = record_page(key, "agenda", title, url, base_path)
+    elif node is None:
+        agenda = AgendaOrFlatPage(title, url)
+        agenda.to_file(base_path)
+        node = agenda.to_node()
+        CHECKPOINT.save_node(key, node)
+    return node
+
+
+def record_page(key, kind, title, url, base_path):
+    """Placeholder of a page to package (kind of PAGE_CLASSES), recorded in
+    MANIFEST with its HTML and assets ; None if it has no body
+
+    a resumed run keeps the pages already recorded"""
+    if CHECKPOINT.resume and MANIFEST.has_page(key):
+        return placeholder(key, url)
+    document = download(url)
+    page = None
+    if document is not None:
+        page = PAGE_CLASSES[kind](title, url, document=document)
+    if page is None or page.body() is None:
+        LOGGER.error("Empty body in {}".format(url))
+        return
+    assets = page.assets() if kind == "chapter" else []
+    MANIFEST.add_page(
+        key,
+        kind,
+        page.title,
+        url,
+        base_path,
+        PAGE_STORE.store(document),
+        assets,
+    )
+    return placeholder(key, url)
+
+
 class CourseIndex(object):
-    def __init__(self, title, url, visited_urls=None):
+    """Index of courses, books or nested indexes
+
+    its links are read from its page, or from `tree` (a discovery.PageTree)
+    when it is known from the pages API, in which case the page of a nested
+    index is not loaded at all"""
+
+    def __init__(self, title, url, visited_urls=None, tree=None):
         if not title:
             raise Exception("CourseIndex title cannot be None or empty")
         if not url:
@@ -446,7 +659,8 @@ class CourseIndex(object):
         self.lang = "en"
         self.description = None
         self.tree_nodes = OrderedDict()
-        self.soup = self.to_soup()
+        self.tree = tree
+        self.soup = self.to_soup() if tree is None else None
         self.author()
         self._thumbnail = None
         self.visited_urls = visited_urls if visited_urls is not None else set([])
@@ -454,16 +668,11 @@ class CourseIndex(object):
         LOGGER.info(f"-----    url: {self.source_id}")
 
     def to_soup(self, loadjs=False):
-        document = download(self.source_id, loadjs=loadjs)
-        try:
-            response = requests.get(self.source_id, timeout=20)
-        except Exception as exc:
-            LOGGER.error(exc)
-        else:
-            if response.status_code == 200:
-                self.source_id = response.url
-            if document is not None:
-                return BeautifulSoup(document, "html5lib")  # html5lib
+        page = fetch(self.source_id, loadjs=loadjs)
+        if page is not None:
+            if page.status == 200:
+                self.source_id = page.url
+            return page_soup(self.source_id, parser_for("index"), loadjs=loadjs)
 
     @property
     def thumbnail(self):
@@ -484,7 +693,10 @@ class CourseIndex(object):
                 if tag_a is not None:
                     return tag_a.text
 
-    def index(self, base_path):
+    def links(self):
+        """links to crawl from this index page and thumbnails map
+
+        returns "cycle" if back to a main collection or None if nothing to crawl"""
         base_url_path_elems = urlparse(self.source_id).path.split("/")
 
         # exit this if we're back to main collection
@@ -496,6 +708,13 @@ class CourseIndex(object):
         ):
             return "cycle"
 
+        # subpages known from the pages API
+        if self.tree is not None:
+            if not self.tree.children:
+                return
+            thumbnails = thumbnails_links(self.soup, "li", "mt-sortable-listing")
+            return [TreeLink(page) for page in self.tree.children], thumbnails or {}
+
         # retry then give up if can't get html doc
         if self.soup is None:
             retry_times = 0
@@ -523,11 +742,11 @@ class CourseIndex(object):
         # if there's no topic links neither, look for other links
         if len(courses_link) == 0:
             query = QueryPage(self.soup, self.source_id)
-            body = query.body()
+            hierarchy = query.links()
 
             # any link within the <body>
-            if body is not None:
-                courses_link = body.find_all("a")
+            if hierarchy is not None:
+                courses_link = hierarchy
 
             # or any links within a div.wiki-tree
             else:
@@ -544,82 +763,13 @@ class CourseIndex(object):
 
         # keep thumbnails links for topic links
         thumbnails = thumbnails_links(self.soup, "li", "mt-sortable-listing")
+        return courses_link, thumbnails
 
-        index_base_path = base_path  # build_path([base_path])
-
-        # loop over all links (either for topic or course)
-        for course_link in courses_link:
-            # build course link name
-            course_link_name = (
-                course_link.find("span", class_="mt-sortable-listing-title")
-                or course_link
-            ).text.strip()
-            course_link_href = course_link.attrs.get("href", "")
-
-            # skip link if we're already visited it. record visit otherwie
-            if course_link_href in self.visited_urls:
-                continue
-            self.visited_urls.add(course_link_href)
-
-            # get HTML source of the target link
-            document = download(course_link_href)
-            chapter_basepath = build_path([index_base_path, hashed(course_link_name)])
-            if document is not None:
-
-                # get topic hierarchy from API
-                query = QueryPage(
-                    BeautifulSoup(document, "html.parser"), course_link_href
-                )
+    def index(self, base_path):
+        """crawls this index and its nested indexes into tree_nodes
 
-                course_body = query.body()
-
-                # topic hierarchy retrieved ; build a course and its chapters
-                if course_body is not None:
-                    course = Course(course_link_name, course_link_href, self.author())
-                    course.thumbnail = thumbnails.get(course_link_href, None)
-                    for chapter_title in course_body.find_all("a"):
-                        chapter = Chapter(
-                            chapter_title.text, chapter_title.attrs.get("href", "")
-                        )
-                        chapter.thumbnail = thumbnails.get(course_link_href, None)
-                        chapter.to_file(chapter_basepath)
-                        node = chapter.to_node()
-                        course.add_node(node)
-                    self.add_node(course.to_node())
-
-                # no topic hierarchy retrieved
-                else:
-                    if course_link_name == "Agenda":
-                        agenda = AgendaOrFlatPage(course_link_name, course_link_href)
-                        agenda.to_file(chapter_basepath)
-                        self.add_node(agenda.to_node())
-                    elif course_link_name in [
-                        "CalcPlot3D Interactive Figures",
-                        "GeoGebra Simulations",
-                    ]:  # Not supported
-                        pass
-                    else:
-                        course_index = CourseIndex(
-                            course_link_name or course_link.attrs.get("title"),
-                            course_link_href,
-                            visited_urls=self.visited_urls,
-                        )
-                        course_index.description = course_link.attrs.get("title")
-                        course_index.thumbnail = thumbnails.get(course_link_href, None)
-                        result = course_index.index(
-                            build_path([base_path, hashed(course_link_name)])
-                        )
-
-                        if result is None:
-                            course_index_node = course_index.to_node()
-                            if len(course_index_node["children"]) == 0:
-                                chapter = Chapter(course_link_name, course_link_href)
-                                chapter.to_file(chapter_basepath)
-                                node = chapter.to_node()
-                                self.add_node(node)
-                            else:
-                                self.add_node(course_index_node)
-            # break
+        returns "cycle" if back to a main collection, None otherwise"""
+        return IndexCrawl(order=CRAWL_ORDER, max_depth=MAX_DEPTH).run(self, base_path)
 
     def add_node(self, node):
         if node is not None:
@@ -675,71 +825,341 @@ class Course(object):
         )
 
 
+class Deferred:
+    """node produced by fn(*args) once the frontier schedules it
+
+    started on CRAWLER's workers ; result() runs it inline if never started"""
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = partial(fn, *args, **kwargs)
+        self.future = None
+
+    def start(self):
+        if self.future is None:
+            self.future = CRAWLER.submit(self.fn)
+
+    def result(self):
+        self.start()
+        return self.future.result()
+
+
+class PendingCourse:
+    """ Course which chapters are being packaged """
+
+    def __init__(self, course, chapters):
+        self.course = course
+        self.chapters = chapters
+
+    def result(self):
+        for chapter in self.chapters:
+            self.course.add_node(chapter.result())
+        return self.course.to_node()
+
+
+class IndexFrame:
+    """CourseIndex being crawled: one slot per link, in links order
+
+    slots hold anything with a result() returning a node (or None)"""
+
+    def __init__(self, course_index, base_path, depth, parent=None, link=None):
+        self.course_index = course_index
+        self.base_path = base_path
+        self.depth = depth
+        self.parent = parent
+        # (name, href, chapter_basepath) of the link leading to this index
+        self.link = link
+        self.slots = []
+        self.thumbnails = {}
+        # links of this index not prefetched yet, see IndexCrawl.prefetch
+        self.prefetches = deque()
+        self.outcome = None
+        self.fallback = None
+        self.node = None
+
+    def result(self):
+        return self.node
+
+    def assemble(self):
+        """ fills course_index from slots then computes this frame's node """
+        for pending in self.slots:
+            if pending is not None:
+                self.course_index.add_node(pending.result())
+
+        if self.parent is None or self.outcome == "cycle":
+            return
+
+        course_index_node = self.course_index.to_node()
+        if len(course_index_node["children"]) == 0:
+            # not an index after all ; package it as a chapter
+            if self.fallback is None:
+                self.fallback = Deferred(package_chapter, *self.link)
+            self.node = self.fallback.result()
+        else:
+            self.node = course_index_node
+
+
+class IndexCrawl:
+    """Iterative crawl of a CourseIndex and its nested indexes
+
+    Pending links and chapter packaging live on an explicit Frontier instead of
+    the call stack. `order` is dfs (same visiting order as the former recursive
+    walk), bfs or priority (structure pages first, by depth, then packaging).
+    Indexes nested deeper than `max_depth` are not descended into.
+
+    Each index gets an IndexFrame ; once the frontier is exhausted, frames are
+    assembled into the nested topic dicts, children first.
+
+    Links are prefetched ahead of their visit, at most half of what PAGES
+    holds at once ; their pages are pinned in PAGES until visited, so that
+    the pages fetched meanwhile (nested indexes first) do not evict them."""
+
+    def __init__(self, order="dfs", max_depth=None):
+        self.frontier = Frontier(order)
+        self.max_depth = max_depth
+        self.frames = []
+        self.window = max(PAGES.pages.size // 2, 1)
+        self.prefetched = set()  # prefetched links not visited yet
+
+    def run(self, course_index, base_path):
+        root = IndexFrame(course_index, base_path, depth=0)
+        self.expand(root)
+        while len(self.frontier) > 0:
+            task = self.frontier.pop()
+            task()
+
+        for frame in reversed(self.frames):
+            frame.assemble()
+        return root.outcome
+
+    def schedule(self, deferred, depth):
+        self.frontier.push(deferred.start, priority=(1, depth))
+
+    def expand(self, frame):
+        """ queues visits of frame's links """
+        self.frames.append(frame)
+        links = frame.course_index.links()
+        if links is not None and links != "cycle" and len(links[0]) == 0:
+            # nothing to crawl either: packaged as a chapter right away
+            links = None
+        if links is None or links == "cycle":
+            frame.outcome = links
+            if links is None and frame.parent is not None:
+                frame.fallback = Deferred(package_chapter, *frame.link)
+                self.schedule(frame.fallback, frame.depth)
+            return
+
+        courses_link, frame.thumbnails = links
+        frame.slots = [None] * len(courses_link)
+
+        # warm up sibling pages concurrently ; visits stay sequential as they
+        # own visited_urls and the tree_nodes ordering
+        frame.prefetches.extend(
+            course_link.attrs.get("href", "")
+            for course_link in courses_link
+            if not isinstance(course_link, TreeLink)
+        )
+        self.prefetch(frame)
+
+        self.frontier.extend(
+            [
+                partial(self.visit, frame, slot, course_link)
+                for slot, course_link in enumerate(courses_link)
+            ],
+            priority=(0, frame.depth),
+        )
+
+    def prefetch(self, frame):
+        """prefetches the next links of frame while fewer than `window`
+        prefetched links wait for their visit"""
+        if CRAWLER.workers < 2:
+            return
+        visited_urls = frame.course_index.visited_urls
+        while frame.prefetches and len(self.prefetched) < self.window:
+            href = frame.prefetches.popleft()
+            if href and href not in visited_urls and href not in self.prefetched:
+                self.prefetched.add(href)
+                PAGES.pin(href)
+                CRAWLER.prefetch(fetch, href)
+
+    def visit(self, frame, slot, course_link):
+        """ fills a slot of frame's index, then prefetches its next links """
+        href = course_link.attrs.get("href", "")
+        try:
+            self.visit_link(frame, slot, course_link)
+        finally:
+            if href in self.prefetched:
+                self.prefetched.discard(href)
+                PAGES.unpin(href)
+            self.prefetch(frame)
+
+    def visit_link(self, frame, slot, course_link):
+        """ fetches a link of frame's index and fills its slot """
+        course_index = frame.course_index
+        thumbnails = frame.thumbnails
+
+        # build course link name
+        course_link_name = (
+            course_link.find("span", class_="mt-sortable-listing-title") or course_link
+        ).text.strip()
+        course_link_href = course_link.attrs.get("href", "")
+
+        # skip link if we're already visited it. record visit otherwie
+        if course_link_href in course_index.visited_urls:
+            return
+        course_index.visited_urls.add(course_link_href)
+        CHECKPOINT.visit(course_link_href)
+        if PLAN is not None:
+            PLAN.done(course_link_href)
+
+        tree = getattr(course_link, "tree", None)
+        leaf = tree is None and PLAN is not None and PLAN.is_leaf(course_link_href)
+        if leaf:
+            # a planned page without subpages is a chapter: no need to load it
+            # as a possible course or index
+            chapter_basepath = build_path([frame.base_path, hashed(course_link_name)])
+            chapter_links = None
+        elif tree is not None:
+            # known from the pages API: guides' subpages are their chapters
+            chapter_basepath = build_path([frame.base_path, hashed(course_link_name)])
+            chapter_links = None
+            if tree.is_guide:
+                chapter_links = [TreeLink(page) for page in tree.descendants()]
+        else:
+            chapter_basepath = build_path([frame.base_path, hashed(course_link_name)])
+            # topic hierarchy of an earlier run, if the page did not change
+            chapter_links = stored_hierarchy(course_link_href)
+            if chapter_links is None:
+                # get HTML source of the target link
+                soup = page_soup(course_link_href, parser_for("link"))
+                if soup is None:
+                    return
+
+                # get topic hierarchy from API
+                query = QueryPage(soup, course_link_href)
+                chapter_links = query.links()
+
+        # topic hierarchy retrieved ; build a course and its chapters
+        if chapter_links is not None:
+            course = Course(course_link_name, course_link_href, course_index.author())
+            course.thumbnail = thumbnails.get(course_link_href, None)
+            chapters = [
+                Deferred(
+                    package_chapter,
+                    chapter_title.text,
+                    chapter_title.attrs.get("href", ""),
+                    chapter_basepath,
+                    thumbnail=thumbnails.get(course_link_href, None),
+                )
+                for chapter_title in chapter_links
+            ]
+            for chapter in chapters:
+                self.schedule(chapter, frame.depth)
+            frame.slots[slot] = PendingCourse(course, chapters)
+
+        # no topic hierarchy retrieved
+        elif course_link_name == "Agenda":
+            agenda = Deferred(
+                package_agenda, course_link_name, course_link_href, chapter_basepath
+            )
+            self.schedule(agenda, frame.depth)
+            frame.slots[slot] = agenda
+        elif course_link_name in [
+            "CalcPlot3D Interactive Figures",
+            "GeoGebra Simulations",
+        ]:  # Not supported
+            pass
+        elif self.max_depth is not None and frame.depth >= self.max_depth:
+            LOGGER.info(f"Max depth reached, skipping {course_link_href}")
+        elif leaf:
+            chapter = Deferred(
+                package_chapter, course_link_name, course_link_href, chapter_basepath
+            )
+            self.schedule(chapter, frame.depth)
+            frame.slots[slot] = chapter
+        else:
+            nested_index = CourseIndex(
+                course_link_name or course_link.attrs.get("title"),
+                course_link_href,
+                visited_urls=course_index.visited_urls,
+                tree=tree,
+            )
+            nested_index.description = course_link.attrs.get("title")
+            nested_index.thumbnail = thumbnails.get(course_link_href, None)
+            nested_frame = IndexFrame(
+                nested_index,
+                build_path([frame.base_path, hashed(course_link_name)]),
+                frame.depth + 1,
+                parent=frame,
+                link=(course_link_name, course_link_href, chapter_basepath),
+            )
+            frame.slots[slot] = nested_frame
+            self.expand(nested_frame)
+
+
 class AgendaOrFlatPage(object):
-    def __init__(self, title, url):
+    def __init__(self, title, url, document=None):
         self.source_id = url
         self.title = title.replace("/", "_")
-        self.soup = self.to_soup()
+        self.soup = self.to_soup(document)
         self.lang = "en"
         self.filepath = None
+        self._walk = None
         LOGGER.info("--- Agenda (Flat Page)" + self.title)
         LOGGER.info("---   url" + self.source_id)
 
-    def write_css_js(self, filepath):
-        with html_writer.HTMLWriter(filepath, "a") as zipper, open(
-            "chefdata/styles.css"
-        ) as f:
-            content = f.read()
-            zipper.write_contents("styles.css", content, directory="css/")
-
-        with html_writer.HTMLWriter(filepath, "a") as zipper, open(
-            "chefdata/scripts.js"
-        ) as f:
-            content = f.read()
-            zipper.write_contents("scripts.js", content, directory="js/")
+    def write_css_js(self, zipper):
+        CSS_JS_ASSETS.write_into(zipper)
 
     def body(self):
         if self.soup is not None:
             return self.soup.find("section", class_="mt-content-container")
 
+    def walk(self, content):
+        """ ContentWalk of content, walked once: before it gets cleaned """
+        if self._walk is None or self._walk.content is not content:
+            self._walk = ContentWalk(content)
+        return self._walk
+
     def clean(self, content):
-        link_to_text(content)
-        remove_links(content)
-        remove_iframes(content)
-        remove_scripts(content)
-        remove_src_set(content)
-        return content
+        return self.walk(content).clean()
 
-    def to_soup(self):
-        document = download(self.source_id)
+    def to_soup(self, document=None):
+        """ soup of document, of the downloaded page if None """
+        if document is None:
+            document = download(self.source_id)
         if document is not None:
-            return BeautifulSoup(document, "html.parser")
+            return BeautifulSoup(document, parser_for("chapter"))
 
-    def write_index(self, filepath, content):
-        with html_writer.HTMLWriter(filepath, "w") as zipper:
-            zipper.write_index_contents(content)
+    def write_index(self, zipper, content):
+        zipper.write_index_contents(content)
 
     def to_file(self, base_path):
         filepath = "{path}/{name}.zip".format(path=base_path, name=hashed(self.title))
-        if file_exists(filepath) and OVERWRITE is False:
+        with CRAWLER.path_locks(filepath):
+            self.write_file(filepath)
+
+    def write_file(self, filepath):
+        if file_exists(filepath) and OVERWRITE is False and not INCREMENTAL:
             self.filepath = filepath
             LOGGER.info("Not overwrited file {}".format(self.filepath))
         elif self.body() is not None:
             self.filepath = filepath
             body = self.clean(self.body())
+            zipper = ZipAssembly()
             try:
                 string_to_write = '<html><head><meta charset="utf-8"><title>{}</title><link rel="stylesheet" href="css/styles.css"></head><body><div class="main-content-with-sidebar">{}</div><script src="js/scripts.js"></body></html>'.format(
                     self.title, body
                 )
                 self.write_index(
-                    self.filepath,
+                    zipper,
                     string_to_write.encode("utf-8", errors="surrogatepass"),
                 )
             except RuntimeError as e:
                 self.filepath = None
                 LOGGER.error(e)
             else:
-                self.write_css_js(self.filepath)
+                self.write_css_js(zipper)
+                zipper.write(self.filepath)
         else:
             LOGGER.error("Empty body in {}".format(self.source_id))
 
@@ -759,12 +1179,13 @@ class AgendaOrFlatPage(object):
 
 
 class Chapter(AgendaOrFlatPage):
-    def __init__(self, title, url):
+    def __init__(self, title, url, document=None):
         self.title = title.replace("/", "_")
         self.source_id = url
-        self.soup = self.to_soup()
+        self.soup = self.to_soup(document)
         self.lang = "en"
         self.filepath = None
+        self._walk = None
         self.video_nodes = None
         self.pdf_nodes = None
         self.phet_nodes = None
@@ -786,40 +1207,12 @@ class Chapter(AgendaOrFlatPage):
             scripts = self.soup.find_all("script", type="text/x-mathjax-config")
             return "".join([str(s) for s in scripts])
 
-    def mathjax_dependences(self, filepath):
-        mathajax_path = "../MathJax-2.7.5/"
-        dependences = [
-            "config/TeX-AMS_HTML.js",
-            "jax/input/TeX/config.js",
-            "jax/input/MathML/config.js",
-            "jax/output/SVG/config.js",
-            "extensions/tex2jax.js",
-            "extensions/mml2jax.js",
-            "extensions/MathMenu.js",
-            "extensions/MathZoom.js",
-            "extensions/TeX/autobold.js",
-            "extensions/TeX/mhchem.js",
-            "extensions/TeX/color.js",
-            "extensions/TeX/boldsymbol.js",
-            "extensions/TeX/cancel.js",
-            "jax/output/HTML-CSS/jax.js",
-            "jax/output/HTML-CSS/fonts/TeX/fontdata.js",
-            "jax/output/HTML-CSS/autoload/mtable.js",
-            # "jax/output/HTML-CSS/imageFonts.js"
-        ]
-        for dep in dependences:
-            filename = dep.split("/")[-1]
-            dep_path = "/".join(dep.split("/")[:-1])
-            dep_file_path = os.path.join(mathajax_path, dep_path, filename)
-            with html_writer.HTMLWriter(filepath, "a") as zipper, open(
-                dep_file_path
-            ) as f:
-                content = f.read()
-                zipper.write_contents(filename, content, directory="js/" + dep_path)
+    def mathjax_dependences(self, zipper):
+        MATHJAX_ASSETS.write_into(zipper)
 
     def to_local_images(self, content):
         images_urls = {}
-        for img in content.findAll("img"):
+        for img in self.walk(content).images():
             try:
                 img_src = img["src"]
             except KeyError:
@@ -827,148 +1220,115 @@ class Chapter(AgendaOrFlatPage):
             else:
                 if img_src.startswith("/"):
                     img_src = urljoin(BASE_URL, img_src)
-                filename = get_name_from_url(img_src)
-                if img_src not in images_urls and img_src:
+                if img_src in images_urls:
+                    img["src"] = images_urls[img_src]
+                elif img_src:
+                    filename = local_filename(img_src, images_urls.values())
                     img["src"] = filename
                     images_urls[img_src] = filename
         return images_urls
 
-    def build_video_nodes(self, base_path, content):
-        videos_url = self.get_videos_urls(content)
-        base_path = build_path([DATA_DIR, DATA_DIR_SUBJECT, "videos"])
-        video_nodes = []
-        for video_url in videos_url:
-            if YouTubeResource.is_youtube(video_url) and not YouTubeResource.is_channel(
-                video_url
-            ):
-                video = YouTubeResource(video_url, lang=self.lang)
-                video.download(download=DOWNLOAD_VIDEOS, base_path=base_path)
-                node = video.to_node()
-                if node is not None:
-                    video_nodes.append(node)
-        return video_nodes
-
-    def build_phet_nodes(self, base_path, content):
-        phet_urls = self.get_phet_simulations(content)
-        base_path = build_path([DATA_DIR, DATA_DIR_SUBJECT, "phet"])
-        phet_nodes = []
-        for phet_url in phet_urls:
-            phet = PhetResource(self.title, phet_url, lang=self.lang)
-            phet.description = None
-            phet.download(download=True, base_path=base_path)
-            node = phet.to_node()
-            if node is not None:
-                phet_nodes.append(node)
-        return phet_nodes
+    def media_urls(self, content):
+        """ {kind of MEDIA_NODES: urls} of the media files of this chapter """
+        return dict(
+            video=self.get_youtube_urls(content),
+            pdf=self.get_pdfs_urls(content),
+            phet=self.get_phet_simulations(content),
+        )
 
-    def get_videos_urls(self, content):
-        urls = set([])
-        if content is not None:
-            video_urls = content.find_all(
-                lambda tag: tag.name == "a"
-                and tag.attrs.get("href", "").find("youtube") != -1
-                or tag.attrs.get("href", "").find("youtu.be") != -1
-                or tag.text.lower() == "youtube"
+    def build_media_nodes(self, kind, base_path, urls):
+        """ Futures of the nodes of media urls of kind, on its MEDIA_POOLS pool """
+        return [
+            MEDIA_POOLS.submit(
+                kind, MEDIA_NODES[kind], url, self.title, base_path, lang=self.lang
             )
+            for url in urls
+        ]
 
-            for video_url in video_urls:
-                urls.add(video_url.get("href", ""))
+    def get_youtube_urls(self, content):
+        return [
+            video_url
+            for video_url in self.get_videos_urls(content)
+            if YouTubeResource.is_youtube(video_url)
+            and not YouTubeResource.is_channel(video_url)
+        ]
 
-            for iframe in content.find_all("iframe"):
-                url = iframe["src"]
-                if YouTubeResource.is_youtube(url) and not YouTubeResource.is_channel(
-                    url
-                ):
-                    urls.add(YouTubeResource.transform_embed(url))
+    def get_videos_urls(self, content):
+        walk = self.walk(content)
+        urls = set(walk.video_hrefs)
+        for iframe in walk.iframes:
+            url = iframe["src"]
+            if YouTubeResource.is_youtube(url) and not YouTubeResource.is_channel(url):
+                urls.add(YouTubeResource.transform_embed(url))
         return urls
 
     def get_pdfs_urls(self, content):
-        urls = set([])
-        if content is not None:
-            pdf_urls = content.findAll(
-                lambda tag: tag.name == "a"
-                and tag.attrs.get("href", "").endswith(".pdf")
-            )
-            for pdf_url in pdf_urls:
-                urls.add(pdf_url.get("href", ""))
-        return urls
+        return set(self.walk(content).pdf_hrefs)
 
     def get_phet_simulations(self, content):
-        urls = set([])
-        if content is not None:
-            phet_urls = content.find_all(
-                lambda tag: tag.name == "iframe"
-                and tag.attrs.get("src", "").find("phet.colorado.edu") != -1
-            )
-            for phet_url in phet_urls:
-                urls.add(phet_url.get("src", ""))
-        return urls
+        return set(self.walk(content).phet_srcs)
 
-    def write_images(self, filepath, images):
-        with html_writer.HTMLWriter(filepath, "a") as zipper:
-            for img_src, img_filename in images.items():
-                try:
-                    if img_src.startswith("data:image/") or img_src.startswith(
-                        "file://"
-                    ):
-                        pass
-                    else:
-                        # zipper.write_url(img_src, img_filename, directory="")
-                        zipper.write_contents(
-                            img_filename,
-                            downloader.read(img_src, timeout=5, session=sess),
-                            directory="",
-                        )
-                except (
-                    requests.exceptions.HTTPError,
-                    requests.exceptions.ConnectTimeout,
-                    requests.exceptions.ConnectionError,
-                    FileNotFoundError,
-                    requests.exceptions.ReadTimeout,
-                ):
-                    pass
-
-    def build_pdfs_nodes(self, base_path, content):
-        pdfs_urls = self.get_pdfs_urls(content)
-        base_path = build_path([base_path, "pdfs"])
-        pdf_nodes = []
-        for pdf_url in pdfs_urls:
-            pdf_file = File(pdf_url, lang=self.lang, name=self.title)
-            pdf_file.download(download=DOWNLOAD_FILES, base_path=base_path)
-            node = pdf_file.to_node()
-            if node is not None:
-                pdf_nodes.append(node)
-        return pdf_nodes
-
-    def write_mathjax(self, filepath):
-        script_tag = self.soup.find(
-            lambda tag: tag.name == "script"
-            and tag.attrs.get("src", "").find("MathJax.js") != -1
+    def write_images(self, zipper, images):
+        images_contents = IMAGES.fetch_all(
+            img_src
+            for img_src in images.keys()
+            if not (img_src.startswith("data:image/") or img_src.startswith("file://"))
         )
-        filepath_js = "chefdata/MathJax.js"
-        if not file_exists(filepath_js) and script_tag:
-            try:
-                r = requests.get(script_tag["src"])
-                with open(filepath_js, "wb") as f:
-                    f.write(r.content)
-            except KeyError:
-                pass
+        for img_src, img_filename in images.items():
+            if img_src in images_contents:
+                zipper.write_contents(
+                    img_filename, images_contents[img_src], directory=""
+                )
+
+    def assets(self):
+        """(kind, url) of the media files and images of this chapter, for the
+        manifest ; its body is cleaned as for packaging"""
+        content = self.body()
+        assets = [
+            (kind, url)
+            for kind, urls in self.media_urls(content).items()
+            for url in urls
+        ]
+        images = self.to_local_images(self.clean(content))
+        assets += [
+            ("image", img_src)
+            for img_src in images
+            if not (img_src.startswith("data:image/") or img_src.startswith("file://"))
+        ]
+        return assets
 
-        with html_writer.HTMLWriter(filepath, "a") as zipper, open(filepath_js) as f:
-            content = f.read()
-            zipper.write_contents("MathJax.js", content, directory="js/")
+    def write_mathjax(self, zipper):
+        if MATHJAX_JS_ASSETS is None:
+            script_tag = self.soup.find(
+                lambda tag: tag.name == "script"
+                and tag.attrs.get("src", "").find("MathJax.js") != -1
+            )
+            with CRAWLER.path_locks(MATHJAX_JS_PATH):
+                load_mathjax_js(script_tag.get("src") if script_tag else None)
+        MATHJAX_JS_ASSETS.write_into(zipper)
 
     def to_file(self, base_path):
-        filepath = "{path}/{name}.zip".format(path=base_path, name=hashed(self.title))
-        if self.body() is not None:
-            self.video_nodes = self.build_video_nodes(base_path, self.body())
-            self.pdf_nodes = self.build_pdfs_nodes(base_path, self.body())
-            self.phet_nodes = self.build_phet_nodes(base_path, self.body())
-        else:
+        """writes the zip, downloading the media nodes not set beforehand on
+        MEDIA_POOLS"""
+        if self.body() is None:
             LOGGER.error("Empty body in {}".format(self.source_id))
             return
+        pending = {
+            kind: self.build_media_nodes(kind, base_path, urls)
+            for kind, urls in self.media_urls(self.body()).items()
+            if getattr(self, "{}_nodes".format(kind)) is None
+        }
+        for kind, futures in pending.items():
+            nodes = [future.result() for future in futures]
+            setattr(
+                self,
+                "{}_nodes".format(kind),
+                [node for node in nodes if node is not None],
+            )
+        super().to_file(base_path)
 
-        if file_exists(filepath) and OVERWRITE is False:
+    def write_file(self, filepath):
+        if file_exists(filepath) and OVERWRITE is False and not INCREMENTAL:
             self.filepath = filepath
             LOGGER.info("Not overwrited file {}".format(self.filepath))
         else:
@@ -976,22 +1336,24 @@ class Chapter(AgendaOrFlatPage):
             mathjax_scripts = self.mathjax()
             body = self.clean(self.body())
             images = self.to_local_images(body)
+            zipper = ZipAssembly()
             try:
                 string_to_write = '<html><head><meta charset="utf-8"><title>{}</title><link rel="stylesheet" href="css/styles.css"></head><body><div class="main-content-with-sidebar">{}</div><script src="js/scripts.js"></script>{}<script src="js/MathJax.js?config=TeX-AMS_HTML"></script></body></html>'.format(
                     self.title, body, mathjax_scripts
                 )
                 self.write_index(
-                    self.filepath,
+                    zipper,
                     string_to_write.encode("utf-8", errors="surrogatepass"),
                 )
             except RuntimeError as e:
                 self.filepath = None
                 LOGGER.error(e)
             else:
-                self.write_images(self.filepath, images)
-                self.write_css_js(self.filepath)
-                self.write_mathjax(self.filepath)
-                self.mathjax_dependences(self.filepath)
+                self.write_images(zipper, images)
+                self.write_css_js(zipper)
+                self.write_mathjax(zipper)
+                self.mathjax_dependences(zipper)
+                zipper.write(self.filepath)
 
     def topic_node(self):
         return dict(
@@ -1050,12 +1412,17 @@ class Chapter(AgendaOrFlatPage):
         return node
 
 
+# kinds of pages recorded in the manifest
+PAGE_CLASSES = dict(chapter=Chapter, agenda=AgendaOrFlatPage)
+
+
 class QueryPage:
     """Access a Page's Topic hierarchy as HTML through MindTouch API
 
     - finds Mindtouch's page-id from a Libretext page (soup)
     - query Mindtouch's API using the id
-    - return soup of this JSON response's `body` field which conteains topic tree"""
+    - return soup of this JSON response's `body` field which conteains topic tree
+    - links() are the links of that tree, kept in CHECKPOINT by page"""
 
     def __init__(self, soup, source_id):
         self.soup = soup
@@ -1063,13 +1430,7 @@ class QueryPage:
         self.source_id = source_id
 
     def get_id(self):
-        page_global_settings = self.soup.find("script", id="mt-global-settings")
-        if page_global_settings:
-            self.x_deki_token = json.loads(page_global_settings.text).get(
-                "apiToken", None
-            )
-        else:
-            self.x_deki_token = None
+        self.x_deki_token = api_token(self.soup)
 
         self.page_id = None
         self.guid = None
@@ -1086,22 +1447,98 @@ class QueryPage:
                 BASE_URL, self.page_id, self.guid
             )
             try:
-                r = requests.get(
-                    url,
-                    headers={
-                        "x-deki-token": "{}".format(self.x_deki_token),
-                        "x-deki-client": "mindtouch-martian",
-                        "x-deki-requested-with": "XMLHttpRequest",
-                    },
-                )
-                json_obj = r.json()
+                json_obj = api_json(url, self.x_deki_token)
                 body = json_obj.get("body", None)
                 if body is not None:
-                    return BeautifulSoup(body, "html.parser")
+                    return BeautifulSoup(body, parser_for("api"))
             except Exception as e:
                 LOGGER.error(e)
                 return None
 
+    def links(self):
+        """links of the topic tree as StoredLinks, None if not retrieved
+
+        stored by page URL (see stored_hierarchy), and reused by later runs
+        while the page and its page id and guid do not change"""
+        if self.page_id is None or self.guid is None:
+            return None
+        links = stored_hierarchy(self.source_id, self.page_id, self.guid)
+        if links is not None:
+            return links
+        body = self.body()
+        if body is None:
+            return None
+        links = [StoredLink.from_tag(a) for a in body.find_all("a")]
+        if CHECKPOINT is not None:
+            CHECKPOINT.save_hierarchy(
+                DATA_DIR_SUBJECT,
+                self.source_id,
+                self.page_id,
+                self.guid,
+                [(link.text, link.attrs) for link in links],
+            )
+        return links
+
+
+def stored_hierarchy(url, page_id=None, guid=None):
+    """StoredLinks of the topic hierarchy of url's page recorded in
+    CHECKPOINT, None if not recorded, recorded with another page id or guid,
+    or if the page changed since (unless resuming)
+
+    looked up by URL, before the page is fetched: an unchanged page is only
+    revalidated"""
+    if CHECKPOINT is None:
+        return None
+    stored = CHECKPOINT.hierarchy(DATA_DIR_SUBJECT, url)
+    if stored is None:
+        return None
+    stored_page_id, stored_guid, links = stored
+    if page_id is not None and (page_id, guid) != (stored_page_id, stored_guid):
+        return None
+    if CHECKPOINT.resume or not page_changed(url):
+        return [StoredLink(text, attrs) for text, attrs in links]
+
+
+def api_token(soup):
+    """ MindTouch API token of a page, None if not found """
+    page_global_settings = soup.find("script", id="mt-global-settings")
+    if page_global_settings:
+        return json.loads(page_global_settings.text).get("apiToken", None)
+
+
+def api_json(url, token=None):
+    """ JSON response of MindTouch API's url, replayed from API_FIXTURES if set """
+
+    def request(url):
+        r = sess.get(
+            url,
+            headers={
+                "x-deki-token": "{}".format(token),
+                "x-deki-client": "mindtouch-martian",
+                "x-deki-requested-with": "XMLHttpRequest",
+            },
+        )
+        r.raise_for_status()
+        return r.json()
+
+    if API_FIXTURES is not None:
+        return API_FIXTURES.get(url, request)
+    return request(url)
+
+
+def page_tree(url, token=None):
+    """ discovery.PageTree of the pages under url, None if the API failed """
+    try:
+        return PageTree.from_json(api_json(tree_url(url), token)["page"])
+    except (
+        requests.exceptions.RequestException,
+        ValueError,
+        KeyError,
+        AttributeError,
+        FileNotFoundError,
+    ) as e:
+        LOGGER.error("Could not get pages tree of {}: {}".format(url, e))
+
 
 class YouTubeResource(object):
     def __init__(
@@ -1130,6 +1567,8 @@ class YouTubeResource(object):
         self.file_format = file_formats.MP4
         self.lang = lang
         self.is_valid = False
+        self.youtube_id = None
+        self.subtitles = []  # languages, from the video registry
 
     def clean_url(self, url):
         if url[-1] == "/":
@@ -1193,46 +1632,32 @@ class YouTubeResource(object):
                 LOGGER.info(str(e))
 
     def subtitles_dict(self):
-        subs = []
-        video_info = self.get_video_info()
-        if video_info is not None:
-            video_id = video_info.get("id", None)
-            if "subtitles" in video_info and video_id is not None:
-                subtitles_info = video_info["subtitles"]
-                LOGGER.info("Subtitles: {}".format(",".join(subtitles_info.keys())))
-                for language in subtitles_info.keys():
-                    subs.append(
-                        dict(
-                            file_type=SUBTITLES_FILE,
-                            youtube_id=video_id,
-                            language=language,
-                        )
-                    )
-        return subs
+        """ subtitle files of the languages recorded when the video was extracted """
+        if self.subtitles:
+            LOGGER.info("Subtitles: {}".format(",".join(self.subtitles)))
+        return [
+            dict(
+                file_type=SUBTITLES_FILE, youtube_id=self.youtube_id, language=language
+            )
+            for language in self.subtitles
+        ]
 
-    def download(self, download=True, base_path=None):
-        download_to = build_path([base_path])
+    def extract(self, download_to, url=None):
+        """record (videos.video_record) of the video (url: its source_id)
+        downloaded into download_to by a single yt-dlp extraction ; None if
+        it could not be downloaded, only IO errors being retried (once)"""
         for i in range(2):
             try:
                 info = self.get_video_info(download_to=download_to, subtitles=False)
-                if info is not None:
-                    LOGGER.info(
-                        "    + Video resolution: {}x{}".format(
-                            info.get("width", ""), info.get("height", "")
-                        )
-                    )
-                    if self.description is None:
-                        self.description = info.get("description", None)
-                    self.filepath = os.path.join(
-                        download_to, "{}.mp4".format(info["id"])
-                    )
-                    self.filename = info["title"]
-                    if (
-                        self.filepath is not None
-                        and os.stat(self.filepath).st_size == 0
-                    ):
-                        LOGGER.info("    + Empty file")
-                        self.filepath = None
+                if info is None:
+                    # failed extraction, logged by get_video_info: recorded
+                    # as such for the run by VIDEOS
+                    return None
+                filepath = os.path.join(download_to, "{}.mp4".format(info["id"]))
+                if os.stat(filepath).st_size == 0:
+                    LOGGER.info("    + Empty file")
+                    return None
+                return video_record(info, filepath)
             except (ValueError, IOError, OSError, URLError, ConnectionResetError) as e:
                 LOGGER.info(e)
                 LOGGER.info("Download retry")
@@ -1246,11 +1671,30 @@ class YouTubeResource(object):
                 LOGGER.info(
                     "    + An error ocurred, may be the video is not available."
                 )
-                return
+                return None
             except (OSError, KeyError) as e:
-                return
-            else:
-                return
+                return None
+
+    def download(self, download=True, base_path=None):
+        download_to = build_path([base_path])
+        extract_fn = partial(self.extract, download_to)
+        if VIDEOS is not None:
+            record = VIDEOS.video(self.source_id, extract_fn)
+        else:
+            record = extract_fn(self.source_id)
+        if record is None:
+            return
+        LOGGER.info(
+            "    + Video resolution: {}x{}".format(
+                record["width"] or "", record["height"] or ""
+            )
+        )
+        if self.description is None:
+            self.description = record["description"]
+        self.filepath = record["path"]
+        self.filename = record["title"]
+        self.youtube_id = record["youtube_id"]
+        self.subtitles = record["subtitles"]
 
     def to_node(self):
         if self.filepath is not None:
@@ -1278,45 +1722,31 @@ class PhetResource(object):
         self.description = None
 
     def download(self, download=True, base_path=None):
-        # download_to = build_path([base_path])
-        dst = tempfile.mkdtemp()
-        download_file(
-            self.source_id,
-            dst,
-            filename="index.html",
-            request_fn=sess.get,
-            middleware_callbacks=[self.process_sim_html],
-        )
-        self.filepath = create_predictable_zip(dst)
+        """zips the sim into SIMULATIONS, once per version, or into the temp
+        dir without SIMULATIONS"""
+        try:
+            if SIMULATIONS is not None:
+                self.filepath = SIMULATIONS.get(
+                    self.source_id, self.fetch, self.process_sim_html
+                )
+            else:
+                self.filepath = zip_simulation(
+                    self.process_sim_html(self.fetch(self.source_id))
+                )
+        except (requests.exceptions.RequestException, OSError) as e:
+            LOGGER.error("Error: {}".format(e))
+
+    def fetch(self, url):
+        """ HTML of the sim at url """
+        response = sess.get(url)
+        response.raise_for_status()
+        return response.text
 
     ##https://github.com/learningequality/sushi-chef-phet/blob/master/chef.py
-    def process_sim_html(self, content, destpath, **kwargs):
+    def process_sim_html(self, content):
         """Remove various pieces of the code that make requests to online resources, to avoid using
         bandwidth for users expecting a fully offline or zero-rated website."""
-
-        # remove "are we online" check
-        content = content.replace(
-            "check:function(){var t=this", "check:function(){return;var t=this"
-        )
-
-        # remove online links from "about" modal
-        content = content.replace(
-            "getLinks:function(", "getLinks:function(){return [];},doNothing:function("
-        )
-
-        soup = BeautifulSoup(content, "html.parser")
-
-        for script in soup.find_all("script"):
-            # remove Google Analytics and online image bug requests
-            if "analytics.js" in str(script):
-                script.extract()
-            # remove menu options that link to online resources
-            if 'createTandem("phetWebsiteButton' in str(script):
-                script.string = re.compile(
-                    '\{[^}]+createTandem\("phetWebsiteButton"\).*createTandem\("getUpdate"[^\}]*\},'
-                ).sub("", script.string.replace("\n", " "))
-
-        return str(soup)
+        return offline_sim_html(content)
 
     def to_node(self):
         if self.filepath is not None:
@@ -1337,7 +1767,7 @@ class PhetResource(object):
 
 
 class File(object):
-    """ Document node from its URL, downloaded to base_path """
+    """ Document node from its URL, downloaded into DOCUMENTS or base_path """
 
     def __init__(self, source_id, lang="en", name=None):
         self.filename = get_name_from_url(source_id)
@@ -1349,19 +1779,29 @@ class File(object):
         self.name = "{}_{}".format(name, self.filename)
 
     def download(self, download=True, base_path=None):
+        """downloads the file into DOCUMENTS, once per URL, or into base_path
+        without DOCUMENTS"""
+        if download is False:
+            return
+        if DOCUMENTS is not None:
+            self.filepath = DOCUMENTS.get(self.source_id, self.filename, self.fetch)
+        else:
+            self.filepath = self.fetch(
+                self.source_id, os.path.join(base_path, self.filename)
+            )
+        if self.filepath is not None:
+            LOGGER.info(
+                "    - Get file: {}, node name: {}".format(self.filename, self.name)
+            )
+
+    def fetch(self, url, path):
+        """ path of the PDF at url downloaded to path, None if not a PDF or on error """
         try:
-            if download is False:
-                return
-            response = sess.get(self.source_id)
-            content_type = response.headers.get("content-type")
-            if content_type is not None and "application/pdf" in content_type:
-                self.filepath = os.path.join(base_path, self.filename)
-                with open(self.filepath, "wb") as f:
-                    for chunk in response.iter_content(10000):
-                        f.write(chunk)
-                LOGGER.info(
-                    "    - Get file: {}, node name: {}".format(self.filename, self.name)
-                )
+            return ranged_download(sess, url, path, accept=("application/pdf",))
+        except IncompleteDownload as e:
+            LOGGER.error("Error: {}".format(e))
+        except requests.exceptions.ChunkedEncodingError as e:
+            LOGGER.error("Error: {}".format(e))
         except requests.exceptions.HTTPError as e:
             LOGGER.info("Error: {}".format(e))
         except requests.exceptions.ConnectionError:
@@ -1390,29 +1830,452 @@ class File(object):
             return node
 
 
-def download(source_id, loadjs=False):
+def video_node(url, title, base_path, lang="en"):
+    """ node of the YouTube video at url, downloaded into the subject's videos """
+    video = YouTubeResource(url, lang=lang)
+    video.download(
+        download=DOWNLOAD_VIDEOS,
+        base_path=build_path([DATA_DIR, DATA_DIR_SUBJECT, "videos"]),
+    )
+    return video.to_node()
+
+
+def pdf_node(url, title, base_path, lang="en"):
+    """node of the PDF at url, downloaded once per URL into DOCUMENTS (into
+    the pdfs of base_path without DOCUMENTS)"""
+    pdf_file = File(url, lang=lang, name=title)
+    pdf_file.download(
+        download=DOWNLOAD_FILES, base_path=build_path([base_path, "pdfs"])
+    )
+    return pdf_file.to_node()
+
+
+def phet_node(url, title, base_path, lang="en"):
+    """ node of the PhET simulation at url, zipped once per version """
+    phet = PhetResource(title, url, lang=lang)
+    phet.description = None
+    phet.download(download=True)
+    return phet.to_node()
+
+
+# node_fn(url, chapter title, chapter base_path) of each kind of media asset
+MEDIA_NODES = dict(video=video_node, pdf=pdf_node, phet=phet_node)
+
+
+def fetch_page(source_id, loadjs=False):
+    """Page of source_id, retried ; None if it could not be fetched
+
+    transient errors (connection errors, throttling, server errors) are
+    retried after a jittered exponential backoff, on top of the host's own
+    slow down (see httpclient) ; permanent ones are recorded and not retried"""
+    reason = known_failure(source_id)
+    if reason is not None:
+        LOGGER.info("Skipping {}, it failed: {}".format(source_id, reason))
+        return
     tries = 0
-    while tries < 20:
+    while tries < FETCH_TRIES:
         try:
-            document = downloader.read(source_id, loadjs=loadjs, session=sess)
-        except requests.exceptions.HTTPError as e:
-            LOGGER.info("Error: {}".format(e))
-        except requests.exceptions.ConnectionError:
-            ### this is a weird error, may be it's raised when the webpage
+            if loadjs:
+                with sess.hosts.slot(source_id):
+                    document = downloader.read(source_id, loadjs=loadjs, session=sess)
+                page = Page(source_id, document, None, {})
+            else:
+                sess.cookies.clear()
+                response = sess.get(source_id, headers=downloader.DEFAULT_HEADERS)
+                response.raise_for_status()
+                page = Page(
+                    response.url,
+                    response.content,
+                    response.status_code,
+                    response.headers,
+                )
+        except (requests.exceptions.RequestException, FileNotFoundError) as e:
+            if permanent_failure(e):
+                LOGGER.error("Error: {}".format(e))
+                save_failure(source_id, e)
+                return
+            ### connection errors may be raised when the webpage
             ### is slow to respond requested resources
-            LOGGER.info("Connection error, the resource will be scraped in 5s...")
-            time.sleep(5 * tries)
-        except requests.exceptions.TooManyRedirects as e:
-            LOGGER.info("Error: {}".format(e))
-        except (requests.exceptions.InvalidURL, FileNotFoundError) as e:
-            LOGGER.error(e)
+            delay = backoff(tries)
+            LOGGER.info(
+                "Error: {}, the resource will be scraped in {:.1f}s...".format(e, delay)
+            )
+            time.sleep(delay)
         else:
-            if document is not None:
-                return document
+            if page is not None and page.body is not None:
+                if CHECKPOINT is not None and not loadjs:
+                    save_validators(source_id, page)
+                return page
         tries += 1
     # return False
 
 
+def known_failure(url):
+    """ reason url failed permanently during this run or a recent one """
+    if CHECKPOINT is not None and FAILURE_TTL:
+        return CHECKPOINT.failure(url)
+
+
+def save_failure(url, exc):
+    if CHECKPOINT is not None and FAILURE_TTL:
+        CHECKPOINT.save_failure(url, str(exc), FAILURE_TTL)
+
+
+def fetch(source_id, loadjs=False):
+    """Page of source_id, fetched once per run (unless loading JS)
+
+    redirects recorded in CHECKPOINT are followed without a request"""
+    if loadjs:
+        return fetch_page(source_id, loadjs=loadjs)
+    if CHECKPOINT is not None and CHECKPOINT.resume:
+        source_id = CHECKPOINT.redirect(source_id) or source_id
+    page = PAGES.page(source_id, fetch_page)
+    if CHECKPOINT is not None and page is not None and page.url != source_id:
+        CHECKPOINT.redirect(source_id, page.url)
+    return page
+
+
+def save_validators(source_id, page):
+    CHECKPOINT.save_validators(
+        source_id,
+        page.headers.get("ETag"),
+        page.headers.get("Last-Modified"),
+        content_digest(page.body),
+    )
+
+
+def page_changed(source_id):
+    """whether source_id changed since the run recorded in CHECKPOINT
+
+    revalidated with a conditional request ; a new page is kept in PAGES"""
+    validators = CHECKPOINT.validators(source_id)
+    if validators is None:
+        return True
+    etag, last_modified, digest = validators
+
+    page = PAGES.cached(source_id)
+    if page is None:
+        headers = dict(downloader.DEFAULT_HEADERS)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        try:
+            response = sess.get(source_id, headers=headers)
+        except requests.exceptions.RequestException as e:
+            LOGGER.info("Error: {}".format(e))
+            return True
+        if response.status_code == 304:
+            return False
+        if response.status_code != 200:
+            return True
+        page = Page(
+            response.url, response.content, response.status_code, response.headers
+        )
+        PAGES.remember(source_id, page)
+        save_validators(source_id, page)
+    return content_digest(page.body) != digest
+
+
+def page_soup(source_id, parser, loadjs=False):
+    """soup of source_id, fetched and parsed once per run
+
+    shared between callers: use only where the soup is not modified"""
+    if loadjs:
+        page = fetch(source_id, loadjs=loadjs)
+        if page is not None:
+            return parsers.parse(page.body, parser)
+        return
+    return PAGES.soup(source_id, parser, fetch_page, parsers.parse)
+
+
+def download(source_id, loadjs=False):
+    """ body of source_id """
+    page = fetch(source_id, loadjs=loadjs)
+    if page is not None:
+        return page.body
+
+
+def load_assets():
+    """ reads files shared by all zips once: styles, scripts and MathJax """
+    global CSS_JS_ASSETS
+    global MATHJAX_ASSETS
+    CSS_JS_ASSETS = AssetBundle.from_files(
+        [
+            ("css/styles.css", os.path.join(DATA_DIR, "styles.css")),
+            ("js/scripts.js", os.path.join(DATA_DIR, "scripts.js")),
+        ]
+    )
+    MATHJAX_ASSETS = AssetBundle.from_files(
+        [("js/" + dep, os.path.join(MATHJAX_PATH, dep)) for dep in MATHJAX_DEPENDENCES]
+    )
+
+
+def load_mathjax_js(src=None):
+    """reads chefdata/MathJax.js once, fetching it from src first if
+    missing"""
+    global MATHJAX_JS_ASSETS
+    if MATHJAX_JS_ASSETS is not None:
+        return
+    if not file_exists(MATHJAX_JS_PATH) and src:
+        r = sess.get(src)
+        tmp_filepath = "{}.{}.tmp".format(MATHJAX_JS_PATH, os.getpid())
+        with open(tmp_filepath, "wb") as f:
+            f.write(r.content)
+        os.replace(tmp_filepath, MATHJAX_JS_PATH)
+    MATHJAX_JS_ASSETS = AssetBundle.from_files([("js/MathJax.js", MATHJAX_JS_PATH)])
+
+
+def mathjax_js_src(pages):
+    """ src of the MathJax.js script of the first chapter of pages having one """
+    for key, kind, title, url, base_path, digest in pages:
+        if kind == "chapter":
+            match = MATHJAX_JS_SRC.search(PAGE_STORE.read(digest))
+            if match is not None:
+                return match.group(1).decode("utf-8")
+
+
+def open_sitemap(url):
+    """ binary stream of the sitemap at url, for sitemap.read_sitemaps """
+    response = sess.get(url, stream=True)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    return response.raw
+
+
+def load_plan(path, refresh=True):
+    """sitemap.Plan of BASE_URL's collections, read from its sitemap and
+    saved to path, or loaded from path unless refresh"""
+    if not refresh and file_exists(path):
+        plan = Plan.load(path, Collection.url_names)
+    else:
+        sitemap_url = urljoin(BASE_URL, "sitemap.xml")
+        plan = Plan(Collection.url_names).extend(
+            read_sitemaps(sitemap_url, open_sitemap)
+        )
+        plan.save(path)
+    LOGGER.info(
+        "Planned {} pages: {}".format(
+            len(plan),
+            ", ".join(
+                "{} {}".format(count, collection)
+                for collection, count in sorted(plan.summary().items())
+            ),
+        )
+    )
+    return plan
+
+
+def fetch_image(img_src):
+    """ image contents, for IMAGES ; None if img_src failed permanently before """
+    if known_failure(img_src) is not None:
+        return
+    try:
+        return downloader.read(img_src, timeout=5, session=sess)
+    except (requests.exceptions.RequestException, FileNotFoundError) as e:
+        if permanent_failure(e):
+            save_failure(img_src, e)
+        raise
+
+
+def unfetched_image(img_src):
+    """ fetch_fn of IMAGES while packaging: images come from the assets stage """
+    raise FileNotFoundError("not fetched by the assets stage")
+
+
+def fetch_asset(asset):
+    """ fetches an asset of MANIFEST and records its result """
+    page_key, kind, url, title, base_path = asset
+    if kind == "image":
+        result = IMAGES.digest(url)
+    else:
+        result = MEDIA_NODES[kind](url, title, base_path)
+    MANIFEST.save_asset(page_key, kind, url, result)
+    return result is not None
+
+
+def submit_asset(asset, engine):
+    """ Future of fetch_asset(asset): media on MEDIA_POOLS, images on engine """
+    kind = asset[1]
+    if kind in MEDIA_NODES:
+        return MEDIA_POOLS.submit(kind, fetch_asset, asset)
+    return engine.submit(fetch_asset, asset)
+
+
+def open_cache(max_bytes=None):
+    """opens the web cache and mounts its adapter on sess: caching policy by
+    URL class, files forever, pages revalidated, API never"""
+    global cache
+    global cache_adapter
+    cache = PackedCache(".webcache.sqlite3")
+    if max_bytes is not None:
+        cache.max_bytes = max_bytes
+    cache_adapter = PolicyCacheAdapter(cache, **POOL)
+    sess.mount("http://", cache_adapter)
+    sess.mount("https://", cache_adapter)
+
+
+def shard_path(filename):
+    """ path of a file of the subject's data, one per shard if sharded """
+    if SHARD is not None:
+        name, ext = os.path.splitext(filename)
+        filename = "{}.{}-of-{}{}".format(name, SHARD[0], SHARD[1], ext)
+    return os.path.join(DATA_DIR, DATA_DIR_SUBJECT, filename)
+
+
+def merge_shards():
+    """merge stage: MANIFEST made of the manifests of every shard of a
+    sharded manifest stage"""
+    paths = {}
+    pattern = re.compile(r"^manifest\.(\d+)-of-(\d+)\.sqlite3$")
+    for filename in os.listdir(os.path.join(DATA_DIR, DATA_DIR_SUBJECT)):
+        match = pattern.match(filename)
+        if match is not None:
+            index, shards = int(match.group(1)), int(match.group(2))
+            paths[index, shards] = os.path.join(DATA_DIR, DATA_DIR_SUBJECT, filename)
+    counts = {shards for _, shards in paths}
+    if len(counts) != 1:
+        raise RuntimeError(
+            "Expected the manifests of a single sharded crawl, found {}".format(
+                sorted(paths) or "none"
+            )
+        )
+    shards = counts.pop()
+    missing = [index for index in range(shards) if (index, shards) not in paths]
+    if missing:
+        raise RuntimeError(
+            "Missing the manifests of shards {} out of {}".format(missing, shards)
+        )
+    MANIFEST.merge([paths[index, shards] for index in range(shards)])
+    pages, assets, _ = MANIFEST.counts()
+    LOGGER.info("Merged {} shards: {} pages, {} assets".format(shards, pages, assets))
+
+
+def fetch_assets(workers):
+    """assets stage: fetches the assets of MANIFEST without a result yet,
+    images on `workers` threads and media on MEDIA_POOLS"""
+    pending = MANIFEST.pending_assets()
+    LOGGER.info("Fetching {} assets".format(len(pending)))
+    engine = CrawlEngine(workers=workers)
+    try:
+        futures = [submit_asset(asset, engine) for asset in pending]
+        fetched = sum(future.result() for future in futures)
+    finally:
+        engine.shutdown()
+    LOGGER.info("Fetched {} of {} assets".format(fetched, len(pending)))
+
+
+# a page to package: kind of PAGE_CLASSES, title, url, base_path, HTML,
+# {kind: media nodes} and {image url: digest} from the assets stage
+PackageJob = namedtuple(
+    "PackageJob", ["kind", "title", "url", "base_path", "document", "media", "images"]
+)
+
+
+def init_packager(images_directory):
+    """sets up a forked packaging process: its own locks, images read from
+    the store only, and no session (nor the parent's cache connection)"""
+    global CRAWLER
+    global IMAGES
+    global sess
+    CRAWLER = CrawlEngine()
+    sess = None
+    IMAGES = ImageStore(images_directory, unfetched_image, workers=1)
+
+
+def package_job(job):
+    """node of a page packaged from job, its zip written ; parsing, cleaning
+    and zipping only, so that it can run on a packaging process"""
+    IMAGES.preload(job.images)
+    item = PAGE_CLASSES[job.kind](job.title, job.url, document=job.document)
+    if job.kind == "chapter":
+        item.video_nodes = job.media["video"]
+        item.pdf_nodes = job.media["pdf"]
+        item.phet_nodes = job.media["phet"]
+    item.to_file(job.base_path)
+    return item.to_node()
+
+
+def page_job(page):
+    """ PackageJob of a page of MANIFEST """
+    key, kind, title, url, base_path, digest = page
+    return PackageJob(
+        kind,
+        title,
+        url,
+        base_path,
+        PAGE_STORE.read(digest),
+        MANIFEST.media_nodes(key),
+        MANIFEST.image_digests(key),
+    )
+
+
+def save_packaged(key, future):
+    if future.exception() is None:
+        MANIFEST.save_node(key, future.result())
+        CHECKPOINT.save_node(key, future.result())
+
+
+def package_pages(workers, image_workers=0):
+    """package stage: packages the pages of MANIFEST on `workers` processes
+    (inline if 1), returns the crawled nodes with their placeholders replaced
+    by the packaged nodes
+
+    with image_workers, the assets of each page not fetched yet are fetched
+    first, the images of all pages on that many threads and their media on
+    MEDIA_POOLS ; a page is handed to the packaging processes once its
+    fetches complete, so that slow downloads hold up neither the other pages
+    nor the threads ; otherwise no request is made"""
+    nodes = MANIFEST.tree()
+    if nodes is None:
+        raise RuntimeError(
+            "No crawled tree in {}, run the manifest stage first".format(MANIFEST.path)
+        )
+    pending = defaultdict(list)
+    if image_workers:
+        for asset in MANIFEST.pending_assets():
+            pending[asset[0]].append(asset)
+    else:
+        IMAGES.fetch_fn = unfetched_image
+    pages = MANIFEST.pages()
+    LOGGER.info("Packaging {} pages".format(len(pages)))
+    packager = CrawlEngine(
+        workers=workers,
+        processes=True,
+        initializer=init_packager,
+        initargs=(IMAGES.directory,),
+    )
+    # images of every page, in page order
+    images = CrawlEngine(workers=image_workers or 1)
+
+    def package(page):
+        future = packager.submit(package_job, page_job(page))
+        future.add_done_callback(partial(save_packaged, page[0]))
+        return future
+
+    def submit(page):
+        key = page[0]
+        node = MANIFEST.packaged_node(key) if CHECKPOINT.resume else None
+        if node is not None:
+            future = Future()
+            future.set_result(node)
+            return future
+        fetches = [submit_asset(asset, images) for asset in pending.get(key, [])]
+        return when_done(fetches, package, page)
+
+    if any(page[1] == "chapter" for page in pages):
+        # before forking: packaging processes make no request
+        load_mathjax_js(None if file_exists(MATHJAX_JS_PATH) else mathjax_js_src(pages))
+    packager.start()
+    try:
+        futures = [submit(page) for page in pages]
+        packaged = {page[0]: future.result() for page, future in zip(pages, futures)}
+    finally:
+        images.shutdown()
+        packager.shutdown()
+    return [resolve(node, packaged) for node in nodes]
+
+
 # The chef subclass
 ################################################################################
 class LibreTextsChef(JsonTreeChef):
@@ -1420,22 +2283,78 @@ class LibreTextsChef(JsonTreeChef):
     SCRAPING_STAGE_OUTPUT_TPL = "ricecooker_{subject}_json_tree.json"
     THUMBNAIL = ""
 
+    def run(self, args, options):
+        cache_max_mb = options.get("--cache-max-mb", None)
+        open_cache(int(cache_max_mb) * 1024**2 if cache_max_mb is not None else None)
+        show_stats = bool(int(options.get("--cache-stats", "0")))
+        prune = bool(int(options.get("--cache-prune", "0")))
+        if show_stats or prune:
+            self.maintain_cache(show_stats, prune)
+            return
+        stage = options.get("--stage", "all")
+        if stage not in ("all",) + STAGES:
+            raise ValueError(f"Unknown stage: {stage}")
+        if stage in ("manifest", "merge", "assets"):
+            # no tree to upload before the package stage
+            self.pre_run(args, options)
+            return
+        super().run(args, options)
+
+    def maintain_cache(self, show_stats, prune):
+        """ cache maintenance mode: reports and/or prunes the web cache """
+        if prune:
+            LOGGER.info("Web cache pruned, {} entries dropped".format(cache.prune()))
+        if show_stats:
+            stats = cache.stats()
+            limit = "none"
+            if stats["max_bytes"] is not None:
+                limit = "{:.0f} MB".format(stats["max_bytes"] / 1024**2)
+            LOGGER.info(
+                "Web cache {}: {} entries, {:.1f} MB ({:.1f} MB uncompressed), "
+                "{} expired, limit {}".format(
+                    cache.path,
+                    stats["entries"],
+                    stats["bytes"] / 1024**2,
+                    stats["raw_bytes"] / 1024**2,
+                    stats["expired"],
+                    limit,
+                )
+            )
+        cache.close()
+
     def pre_run(self, args, options):
         build_path([LibreTextsChef.TREES_DATA_DIR])
-        self.download_css_js()
-        channel_tree = self.scrape(args, options)
-        self.write_tree_to_json(channel_tree)
+        if options.get("--stage", "all") in ("all", "package"):
+            self.download_css_js()
+            load_assets()
+        try:
+            channel_tree = self.scrape(args, options)
+        finally:
+            CRAWLER.shutdown()
+            if IMAGES is not None:
+                IMAGES.shutdown()
+            if CHECKPOINT is not None:
+                CHECKPOINT.close()
+            MEDIA_POOLS.shutdown()
+            if MANIFEST is not None:
+                MANIFEST.close()
+            if VIDEOS is not None:
+                VIDEOS.close()
+            for line in cache_adapter.stats.report():
+                LOGGER.info("Web cache {}".format(line))
+        if channel_tree is not None:
+            self.write_tree_to_json(channel_tree)
         # subject = options.get('--subject', "phys")
         # self.RICECOOKER_JSON_TREE = LibreTextsChef.SCRAPING_STAGE_OUTPUT_TPL.format(subject=subject)
 
     def download_css_js(self):
-        r = requests.get(
+        r = sess.get(
             "https://raw.githubusercontent.com/learningequality/html-app-starter/master/css/styles.css"
         )
         with open("chefdata/styles.css", "wb") as f:
             f.write(r.content)
 
-        r = requests.get(
+        r = sess.get(
             "https://raw.githubusercontent.com/learningequality/html-app-starter/master/js/scripts.js"
         )
         with open("chefdata/scripts.js", "wb") as f:
@@ -1448,6 +2367,27 @@ class LibreTextsChef(JsonTreeChef):
         subject = options.get("--subject")
         overwrite = options.get("--overwrite", "1")
         run_test = bool(int(options.get("--test", "0")))
+        crawl_workers = int(options.get("--crawl-workers", "8"))
+        per_host = int(options.get("--per-host", "4"))
+        rate = float(options.get("--rate", "10"))
+        failure_ttl_days = float(options.get("--failure-ttl-days", "7"))
+        image_workers = int(options.get("--image-workers", "8"))
+        asset_workers = int(options.get("--asset-workers", "8"))
+        video_workers = int(options.get("--video-workers", "2"))
+        document_workers = int(options.get("--document-workers", "4"))
+        simulation_workers = int(options.get("--simulation-workers", "2"))
+        package_workers = int(options.get("--package-workers", os.cpu_count() or 1))
+        stage = options.get("--stage", "all")
+        resume = bool(int(options.get("--resume", "0")))
+        incremental = bool(int(options.get("--incremental", "0")))
+        crawl_order = options.get("--crawl-order", "dfs")
+        max_depth = options.get("--max-depth", None)
+        discovery = options.get("--discovery", "html")
+        use_sitemap = bool(int(options.get("--sitemap", "0")))
+        shard = options.get("--shard", None)
+        api_fixtures = options.get("--api-fixtures", None)
+        api_record = bool(int(options.get("--api-record", "0")))
+        parsers.configure(options.get("--parser", None))
         new_channel_id = options.get(
             "--channel-id", None
         )  # can use {subject} as a placeholder
@@ -1463,8 +2403,79 @@ class LibreTextsChef(JsonTreeChef):
 
         global DATA_DIR_SUBJECT
         global OVERWRITE
+        global CRAWLER
+        global MEDIA_POOLS
         OVERWRITE = bool(int(overwrite))
+        CRAWLER = CrawlEngine(workers=crawl_workers)
+        MEDIA_POOLS = WorkPools(
+            dict(video=video_workers, pdf=document_workers, phet=simulation_workers)
+        )
+        sess.configure(per_host=per_host, rate=rate or None)
+
+        global CRAWL_ORDER
+        global MAX_DEPTH
+        global DISCOVERY
+        global API_FIXTURES
+        if discovery not in ("html", "api"):
+            raise ValueError(f"Unknown discovery mode: {discovery}")
+        DISCOVERY = discovery
+        if api_fixtures is not None:
+            API_FIXTURES = Fixtures(api_fixtures, record=api_record)
+        CRAWL_ORDER = crawl_order
+        MAX_DEPTH = int(max_depth) if max_depth is not None else None
         DATA_DIR_SUBJECT = subject
+
+        global INCREMENTAL
+        global FAILURE_TTL
+        INCREMENTAL = incremental
+        FAILURE_TTL = failure_ttl_days * 24 * 3600
+
+        global SHARD
+        if shard is not None:
+            # a shard's tree lacks the other shards' indexes: they are merged
+            # before the next stages
+            if stage != "manifest":
+                raise ValueError("--shard only applies to --stage=manifest")
+            index, shards = (int(part) for part in shard.split("/"))
+            if not 0 <= index < shards:
+                raise ValueError(f"Invalid shard: {shard}")
+            SHARD = (index, shards)
+
+        global CHECKPOINT
+        global MANIFEST
+        global PAGE_STORE
+        crawling = stage in ("all", "manifest")
+        CHECKPOINT = Checkpoint(
+            shard_path("checkpoint.sqlite3"),
+            resume=resume,
+            incremental=incremental,
+            keep=not crawling,
+        )
+        MANIFEST = Manifest(
+            shard_path("manifest.sqlite3"), reset=crawling and not resume
+        )
+        PAGE_STORE = ContentStore(os.path.join(DATA_DIR, DATA_DIR_SUBJECT, "pages"))
+        global DOCUMENTS
+        DOCUMENTS = Downloads(os.path.join(DATA_DIR, DATA_DIR_SUBJECT, "documents"))
+        global SIMULATIONS
+        SIMULATIONS = SimulationCache(os.path.join(DATA_DIR, DATA_DIR_SUBJECT, "phet"))
+        global VIDEOS
+        VIDEOS = VideoRegistry(
+            os.path.join(DATA_DIR, DATA_DIR_SUBJECT, "videos.sqlite3")
+        )
+        if resume:
+            LOGGER.info(
+                "Resuming crawl, {} URLs visited so far".format(
+                    CHECKPOINT.visited_count()
+                )
+            )
+
+        global IMAGES
+        IMAGES = ImageStore(
+            os.path.join(DATA_DIR, DATA_DIR_SUBJECT, "images"),
+            fetch_image,
+            workers=image_workers,
+        )
         self.RICECOOKER_JSON_TREE = LibreTextsChef.SCRAPING_STAGE_OUTPUT_TPL.format(
             subject=subject
         )
@@ -1498,17 +2509,32 @@ class LibreTextsChef(JsonTreeChef):
         global BASE_URL
         BASE_URL = get_subject_url(subject)
 
+        global PLAN
+        if use_sitemap:
+            PLAN = load_plan(shard_path("plan.txt"), refresh=not resume)
+
         if run_test is True:
             return test(channel_tree)
 
-        browser = Browser(BASE_URL)
-        links = browser.run()
+        if crawling:
+            browser = Browser(BASE_URL)
+            links = browser.run()
 
-        collections = LinkCollection(links)
-        for collection_node in collections.to_node():
-            if collection_node is not None:
-                channel_tree["children"].append(collection_node)
-        return channel_tree
+            collections = LinkCollection(links)
+            MANIFEST.save_tree(
+                [node for node in collections.to_node() if node is not None]
+            )
+            pages, assets, _ = MANIFEST.counts()
+            LOGGER.info("Manifest: {} pages, {} assets".format(pages, assets))
+        if stage == "merge":
+            merge_shards()
+        if stage == "assets":
+            fetch_assets(asset_workers)
+        if stage in ("all", "package"):
+            channel_tree["children"] = package_pages(
+                package_workers, image_workers if stage == "all" else 0
+            )
+            return channel_tree
 
     def write_tree_to_json(self, channel_tree):
         write_tree_to_json_tree(self.scrape_stage, channel_tree)
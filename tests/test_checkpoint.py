@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkpoint import Checkpoint  # noqa: E402
+
+URL = "https://chem.libretexts.org/Bookshelves/Inorganic_Chemistry"
+
+
+def test_resume_incremental_on_new_checkpoint(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "cp.sqlite3"), resume=True, incremental=True)
+    try:
+        assert checkpoint.validators(URL) is None
+    finally:
+        checkpoint.close()
+
+
+def test_resume_keeps_previous_validators(tmp_path):
+    path = str(tmp_path / "cp.sqlite3")
+    checkpoint = Checkpoint(path, incremental=True)
+    checkpoint.save_validators(URL, '"v1"', None, "d1")
+    checkpoint.close()
+
+    # the interrupted incremental run saw the previous run's validators
+    checkpoint = Checkpoint(path, incremental=True)
+    assert checkpoint.validators(URL) == ('"v1"', None, "d1")
+    checkpoint.save_validators(URL, '"v2"', None, "d2")
+    checkpoint.close()
+
+    # resuming it compares against the same run, not its own updates
+    checkpoint = Checkpoint(path, resume=True, incremental=True)
+    try:
+        assert checkpoint.validators(URL) == ('"v1"', None, "d1")
+    finally:
+        checkpoint.close()
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from discovery import Fixtures, PageTree, TreeLink, tree_url  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "api")
+SHELF = "https://chem.libretexts.org/Bookshelves/Inorganic_Chemistry"
+BOOK = SHELF + "/Map%3A_Inorganic_Chemistry_(Housecroft)"
+
+
+def not_recorded(url):
+    raise AssertionError("requested {}".format(url))
+
+
+def recorded_tree(url):
+    response = Fixtures(FIXTURES).get(tree_url(url), not_recorded)
+    return PageTree.from_json(response["page"])
+
+
+def test_tree_url():
+    assert tree_url(BOOK) == (
+        "https://chem.libretexts.org/@api/deki/pages/="
+        "Bookshelves%252FInorganic_Chemistry%252FMap%253A_Inorganic_Chemistry_"
+        "%2528Housecroft%2529/tree?dream.out.format=json"
+    )
+
+
+def test_discovers_recorded_course():
+    shelf = recorded_tree(SHELF)
+    assert shelf.title == "Inorganic Chemistry"
+    assert not shelf.is_guide
+    book, modules = shelf.children
+    assert book.title == "Map: Inorganic Chemistry (Housecroft)"
+    assert book.url == BOOK
+    assert book.is_guide
+    # a course's chapters are all its subpages, depth first
+    assert [page.title for page in book.descendants()] == [
+        "1: Basic Concepts - Atoms",
+        "1.1: Section 1",
+        "1.2: Section 2",
+        "2: Basic Concepts - Molecules",
+        "2.1: Section 1",
+        "2.2: Section 2",
+    ]
+    # a single subpage is an object in the response
+    assert [page.title for page in modules.children] == ["Acids and Bases"]
+    assert modules.children[0].children == []
+    assert TreeLink(book).attrs == {"href": BOOK}
+
+
+def test_course_tree_matches_its_shelf():
+    book = recorded_tree(BOOK)
+    shelf_book = recorded_tree(SHELF).children[0]
+    assert book.page_id == shelf_book.page_id == "300"
+    assert [page.url for page in book.descendants()] == [
+        page.url for page in shelf_book.descendants()
+    ]
+
+
+def test_missing_response(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        Fixtures(str(tmp_path)).get(tree_url(SHELF), not_recorded)
+
+
+def test_records_missing_response(tmp_path):
+    fixtures = Fixtures(str(tmp_path), record=True)
+    response = {"page": {"@id": "1", "title": "Shelf", "uri.ui": SHELF}}
+    assert fixtures.get(tree_url(SHELF), lambda url: response) == response
+    assert Fixtures(str(tmp_path)).get(tree_url(SHELF), not_recorded) == response
@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sitemap import Plan  # noqa: E402
+
+QUESTION = "https://chem.libretexts.org/Bookshelves/A/1%3A_What_is_it%3F"
+FRAGMENT = "https://chem.libretexts.org/Bookshelves/A/2%3A_Sharp_%23"
+
+
+def test_saved_plan_loads_back(tmp_path):
+    plan = Plan(["Bookshelves"]).extend(
+        [QUESTION, FRAGMENT, "https://chem.libretexts.org/Courses/B"]
+    )
+    path = str(tmp_path / "plan.txt")
+    plan.save(path)
+    loaded = Plan.load(path, ["Bookshelves"])
+    assert loaded.pages == plan.pages
+    assert loaded.descendants == plan.descendants
+    assert loaded.is_leaf(QUESTION)
+    assert loaded.is_leaf(FRAGMENT)
+    assert not loaded.is_leaf("https://chem.libretexts.org/Bookshelves/A")
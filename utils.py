@@ -140,24 +140,122 @@ def save_response_content(response, destination):
 def link_to_text(content):
     if content is not None:
         for tag in content.find_all("a"):
-            span = Tag(name="span")
-            if tag.get("href", ""):
-                url = tag["href"]
-                if url.endswith(".pdf"):
-                    pass
-                elif REFERENCE_REGEX.match(url):
-                    # we just remove links for references which are already in
-                    # document, even if the reference is in another course, see
-                    # https://github.com/openzim/librechef/issues/36
-                    pass
-                elif url.startswith("http") or url.startswith("/"):
-                    tag.wrap(span)
-                    span.insert(1, " (" + url + ")")
+            link_tag_to_text(tag)
+
+
+def link_tag_to_text(tag):
+    span = Tag(name="span")
+    if tag.get("href", ""):
+        url = tag["href"]
+        if url.endswith(".pdf"):
+            pass
+        elif REFERENCE_REGEX.match(url):
+            # we just remove links for references which are already in
+            # document, even if the reference is in another course, see
+            # https://github.com/openzim/librechef/issues/36
+            pass
+        elif url.startswith("http") or url.startswith("/"):
+            tag.wrap(span)
+            span.insert(1, " (" + url + ")")
 
 
 def remove_src_set(content):
     if content is None:
         return
     for img_tag in content.find_all("img"):
-        if 'srcset' in img_tag.attrs:
-            del img_tag['srcset']
\ No newline at end of file
+        remove_tag_src_set(img_tag)
+
+
+def remove_tag_src_set(img_tag):
+    if 'srcset' in img_tag.attrs:
+        del img_tag['srcset']
+
+
+class ContentWalk:
+    """Single walk over a chapter's content, collecting what cleaning and
+    packaging act on instead of running one find_all per helper
+
+    - anchors, iframes, scripts and images, in document order
+    - as of before cleaning: hrefs of the tags Chapter.get_videos_urls
+      matches (YouTube links, youtu.be hrefs, tags which text is "youtube"),
+      hrefs of PDF links and srcs of PhET iframes
+
+    clean() applies link_to_text, remove_links, remove_iframes,
+    remove_scripts then remove_src_set to the collected tags, with the same
+    result ; images() are the images left by clean()"""
+
+    def __init__(self, content):
+        self.content = content
+        self.anchors = []
+        self.iframes = []
+        self.scripts = []
+        self.imgs = []
+        self.video_hrefs = set()
+        self.pdf_hrefs = set()
+        self.phet_srcs = set()
+        self.cleaned = False
+        if content is not None:
+            self.walk()
+
+    def walk(self):
+        checked = set()
+        for element in self.content.descendants:
+            if not isinstance(element, Tag):
+                if 0 < len(element) <= len("youtube") and element.lower() in "youtube":
+                    self.check_youtube_text(element, checked)
+                continue
+            href = element.attrs.get("href", "")
+            if element.name == "a":
+                self.anchors.append(element)
+                if href.find("youtube") != -1:
+                    self.video_hrefs.add(href)
+                if href.endswith(".pdf"):
+                    self.pdf_hrefs.add(href)
+            elif element.name == "iframe":
+                self.iframes.append(element)
+                src = element.attrs.get("src", "")
+                if src.find("phet.colorado.edu") != -1:
+                    self.phet_srcs.add(src)
+            elif element.name == "script":
+                self.scripts.append(element)
+            elif element.name == "img":
+                self.imgs.append(element)
+            if href.find("youtu.be") != -1:
+                self.video_hrefs.add(href)
+
+    def check_youtube_text(self, string, checked):
+        """adds the hrefs of the ancestors of string which text is "youtube" ;
+        ancestors of a tag with a longer text have a longer text too"""
+        tag = string.parent
+        while tag is not None and tag is not self.content and id(tag) not in checked:
+            checked.add(id(tag))
+            text = tag.text.lower()
+            if text == "youtube":
+                self.video_hrefs.add(tag.attrs.get("href", ""))
+            elif len(text) > len("youtube"):
+                break
+            tag = tag.parent
+
+    def clean(self):
+        """ cleaned content, cleaned once """
+        if self.content is not None and not self.cleaned:
+            self.cleaned = True
+            for tag in self.anchors:
+                link_tag_to_text(tag)
+            for tag in self.anchors:
+                tag.replaceWithChildren()
+            for tag in self.iframes + self.scripts:
+                tag.extract()
+            for tag in self.imgs:
+                remove_tag_src_set(tag)
+        return self.content
+
+    def images(self):
+        """ images in the content, in document order """
+        return [img for img in self.imgs if self.contains(img)]
+
+    def contains(self, tag):
+        for parent in tag.parents:
+            if parent is self.content:
+                return True
+        return False
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import Future
+from urllib.parse import parse_qs, urlparse
+
+from utils import file_exists
+
+LOGGER = logging.getLogger()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    youtube_id TEXT PRIMARY KEY, title TEXT, description TEXT,
+    width INTEGER, height INTEGER, path TEXT NOT NULL, subtitles TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, youtube_id TEXT NOT NULL);
+"""
+FIELDS = ("youtube_id", "title", "description", "width", "height", "path", "subtitles")
+
+
+def youtube_id(url):
+    """ id of the YouTube video at url, None if it cannot be read from the URL """
+    parsed = urlparse(url)
+    if parsed.netloc.endswith("youtu.be"):
+        return parsed.path.strip("/").split("/")[0] or None
+    ids = parse_qs(parsed.query).get("v")
+    if ids:
+        return ids[0]
+    parts = parsed.path.strip("/").split("/")
+    if len(parts) >= 2 and parts[0] in ("embed", "v", "shorts"):
+        return parts[1]
+
+
+def video_record(info, path):
+    """registry record of a video downloaded to path, from its yt-dlp info ;
+    subtitles are the languages available, fetched when the channel is built"""
+    return dict(
+        youtube_id=info["id"],
+        title=info.get("title"),
+        description=info.get("description"),
+        width=info.get("width"),
+        height=info.get("height"),
+        path=path,
+        subtitles=sorted((info.get("subtitles") or {}).keys()),
+    )
+
+
+class VideoRegistry:
+    """SQLite registry of the YouTube videos downloaded, by YouTube id
+
+    - title, description, resolution, file path and subtitle languages of
+      each video, as read by a single yt-dlp extraction
+    - each video is extracted once per run, concurrent lookups wait for the
+      first ; a failed extraction is not retried before the next run
+    - a recorded video whose file is still on disk is reused by later runs
+      without any request"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._videos = {}  # youtube id or URL: Future of record
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self.conn.executescript(SCHEMA)
+
+    def stored(self, key):
+        """ record of youtube id or URL key, None if missing or its file is gone """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT {} FROM videos WHERE youtube_id = COALESCE("
+                "(SELECT youtube_id FROM urls WHERE url = ?), ?)".format(
+                    ", ".join(FIELDS)
+                ),
+                (key, key),
+            ).fetchone()
+        if row is not None:
+            record = dict(zip(FIELDS, row))
+            record["subtitles"] = json.loads(record["subtitles"])
+            if file_exists(record["path"]):
+                return record
+
+    def save(self, url, record):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?)",
+                tuple(
+                    json.dumps(record[field]) if field == "subtitles" else record[field]
+                    for field in FIELDS
+                ),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO urls VALUES (?, ?)",
+                (url, record["youtube_id"]),
+            )
+            self.conn.execute("COMMIT")
+
+    def video(self, url, extract_fn):
+        """record of the video at url ; extract_fn(url) downloads it and
+        returns its record (see video_record), or None on failure"""
+        key = youtube_id(url) or url
+        with self._lock:
+            future = self._videos.get(key)
+            owner = future is None
+            if owner:
+                future = self._videos[key] = Future()
+        if not owner:
+            return future.result()
+
+        record = None
+        try:
+            record = self.stored(key)
+            if record is None:
+                record = extract_fn(url)
+                if record is not None:
+                    self.save(url, record)
+                else:
+                    LOGGER.info("Video not extracted {}".format(url))
+        except Exception as exc:
+            LOGGER.info("Video not extracted {}: {}".format(url, exc))
+        if record is not None and record["youtube_id"] != key:
+            with self._lock:
+                if record["youtube_id"] not in self._videos:
+                    self._videos[record["youtube_id"]] = future
+        future.set_result(record)
+        return record
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
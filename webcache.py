@@ -0,0 +1,296 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+from cachecontrol.cache import BaseCache
+from requests.adapters import HTTPAdapter
+from ricecooker.utils.caching import (
+    CacheControlAdapter,
+    CacheForeverHeuristic,
+    NeverCache,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FOREVER = "forever"  # kept forever, never revalidated
+REVALIDATE = "revalidate"  # kept, revalidated on every request
+NO_CACHE = "no-cache"  # never kept
+
+STATIC_EXTENSIONS = (
+    ".js",
+    ".css",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".svg",
+    ".woff",
+    ".woff2",
+)
+STATIC_HOSTS = ("raw.githubusercontent.com",)
+# large files kept on disk by their callers: PDFs, sitemaps, PhET sims
+UNCACHED_EXTENSIONS = (".pdf", ".xml", ".xml.gz")
+UNCACHED_HOSTS = ("phet.colorado.edu",)
+
+
+def url_class(url):
+    """caching policy of url
+
+    - forever: MindTouch files (images...) and static JS/CSS/images
+    - no-cache: other MindTouch API calls, which carry a session token, and
+      large files stored on disk once fetched (PDFs, sitemaps, PhET sims)
+    - revalidate: pages' HTML and everything else"""
+    parsed = urlparse(url)
+    path = parsed.path.lower()
+    if parsed.netloc in UNCACHED_HOSTS or path.endswith(UNCACHED_EXTENSIONS):
+        return NO_CACHE
+    if "/@api/deki/files/" in path:
+        return FOREVER
+    if "/@api/" in path:
+        return NO_CACHE
+    if parsed.netloc in STATIC_HOSTS or path.endswith(STATIC_EXTENSIONS):
+        return FOREVER
+    return REVALIDATE
+
+
+# compression of stored responses, zstd if installed
+ZLIB = "zlib"
+ZSTD = "zstd"
+CODEC = ZSTD if zstandard is not None else ZLIB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    codec TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    raw_size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def compress(value, codec=CODEC):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(value)
+    return zlib.compress(value, 6)
+
+
+def decompress(value, codec):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ValueError("zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(value)
+    return zlib.decompress(value)
+
+
+def expiry(expires, now):
+    """ timestamp at which an entry set with cachecontrol's expires ends """
+    if expires is None:
+        return None
+    if isinstance(expires, datetime):
+        if expires.tzinfo is None:
+            expires = expires.replace(tzinfo=timezone.utc)
+        return expires.timestamp()
+    return now + expires
+
+
+class PackedCache(BaseCache):
+    """cachecontrol cache packed in a single SQLite file
+
+    - responses are stored compressed (zstd if installed, zlib otherwise)
+    - when stored responses exceed `max_bytes` (compressed), the least
+      recently used ones are evicted down to `low_water` of it
+    - entries set with an expiry are dropped once expired"""
+
+    def __init__(self, path, max_bytes=2 * 1024**3, low_water=0.9):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self.conn.executescript(SCHEMA)
+            self.total = self._total()
+
+    def _total(self):
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value, codec, expires FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, codec, expires = row
+            if expires is not None and expires <= now:
+                self._delete(key)
+                return None
+            self.conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        try:
+            return decompress(value, codec)
+        except Exception:
+            self.delete(key)
+            return None
+
+    def set(self, key, value, expires=None):
+        now = time.time()
+        packed = compress(value)
+        with self._lock:
+            self._delete(key)
+            self.conn.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    packed,
+                    CODEC,
+                    len(packed),
+                    len(value),
+                    expiry(expires, now),
+                    now,
+                ),
+            )
+            self.total += len(packed)
+            if self.max_bytes is not None and self.total > self.max_bytes:
+                self._evict(int(self.max_bytes * self.low_water))
+
+    def delete(self, key):
+        with self._lock:
+            self._delete(key)
+
+    def _delete(self, key):
+        row = self.conn.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total -= row[0]
+
+    def _evict(self, target):
+        """ drops least recently used entries until at most target bytes remain """
+        evicted = 0
+        cursor = self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ).fetchall()
+        keys = []
+        for key, size in cursor:
+            if self.total - evicted <= target:
+                break
+            keys.append((key,))
+            evicted += size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self.total -= evicted
+        return len(keys)
+
+    def stats(self):
+        """ {entries, bytes, raw_bytes, expired, max_bytes} of stored responses """
+        with self._lock:
+            entries, size, raw_size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), "
+                "COALESCE(SUM(raw_size), 0) FROM responses"
+            ).fetchone()
+            expired = self.conn.execute(
+                "SELECT COUNT(*) FROM responses WHERE expires <= ?", (time.time(),)
+            ).fetchone()[0]
+        return dict(
+            entries=entries,
+            bytes=size,
+            raw_bytes=raw_size,
+            expired=expired,
+            max_bytes=self.max_bytes,
+        )
+
+    def prune(self, max_bytes=None):
+        """drops expired entries, then LRU ones above max_bytes, and compacts
+        the file ; returns the number of entries dropped"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            dropped = self.conn.execute(
+                "DELETE FROM responses WHERE expires <= ?", (time.time(),)
+            ).rowcount
+            self.total = self._total()
+            if max_bytes is not None and self.total > max_bytes:
+                dropped += self._evict(max_bytes)
+            self.conn.execute("VACUUM")
+        return dropped
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class CacheStats:
+    """ thread-safe counts of cache hits and misses per URL class """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def record(self, url_class, hit):
+        with self._lock:
+            (self.hits if hit else self.misses)[url_class] += 1
+
+    def report(self):
+        """ one line per URL class """
+        lines = []
+        for url_class_ in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits[url_class_], self.misses[url_class_]
+            lines.append(
+                "{}: {} hits, {} misses ({:.0%} hit rate)".format(
+                    url_class_, hits, misses, hits / (hits + misses)
+                )
+            )
+        return lines
+
+
+class PolicyCacheAdapter(HTTPAdapter):
+    """Transport adapter caching responses in `cache` by URL class policy
+
+    requests are dispatched to a caching adapter per class (see url_class)
+    and counted in `stats` ; streamed requests are never cached, their
+    bodies being written to disk by the caller rather than buffered"""
+
+    def __init__(self, cache, classify=url_class, **kwargs):
+        super().__init__(**kwargs)
+        self.classify = classify
+        self.stats = CacheStats()
+        self.adapters = {
+            FOREVER: CacheControlAdapter(
+                heuristic=CacheForeverHeuristic(), cache=cache, **kwargs
+            ),
+            REVALIDATE: CacheControlAdapter(
+                heuristic=NeverCache(), cache=cache, **kwargs
+            ),
+            NO_CACHE: HTTPAdapter(**kwargs),
+        }
+
+    def send(self, request, **kwargs):
+        policy = NO_CACHE if kwargs.get("stream") else self.classify(request.url)
+        response = self.adapters[policy].send(request, **kwargs)
+        self.stats.record(policy, getattr(response, "from_cache", False))
+        return response
+
+    def close(self):
+        for adapter in self.adapters.values():
+            adapter.close()
+        super().close()